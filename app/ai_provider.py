@@ -0,0 +1,147 @@
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+import asyncio
+import os
+import re
+
+# Which backend answers /api/ai/chat: "gemini" (default) or "fake" (local, for tests and benchmarks)
+AI_PROVIDER = os.getenv("WAREHOUSE_AI_PROVIDER", "gemini")
+GEMINI_MODEL = os.getenv("WAREHOUSE_GEMINI_MODEL", "gemini-1.5-flash")
+# Per-token delay of the fake provider, to imitate upstream latency
+FAKE_TOKEN_DELAY_MS = float(os.getenv("WAREHOUSE_FAKE_AI_DELAY_MS", "0"))
+
+# Admission control: upstream calls in flight, callers allowed to wait for a slot, and for how long
+AI_CONCURRENCY = int(os.getenv("WAREHOUSE_AI_CONCURRENCY", "4"))
+AI_QUEUE_DEPTH = int(os.getenv("WAREHOUSE_AI_QUEUE_DEPTH", "16"))
+AI_QUEUE_TIMEOUT = float(os.getenv("WAREHOUSE_AI_QUEUE_TIMEOUT", "10"))
+
+
+@dataclass
+class ChatEvent:
+    """One streamed piece of a reply: either text or a function call."""
+    text: str = ""
+    function_call: Optional[str] = None
+    args: dict = field(default_factory=dict)
+
+
+class Provider:
+    """Interface for chat backends. `stream` yields ChatEvents as they arrive.
+
+    `context` (e.g. the inventory summary) is sent alongside the user message.
+    """
+
+    def stream(self, message: str, context: Optional[str] = None) -> AsyncIterator[ChatEvent]:
+        raise NotImplementedError
+
+
+class GeminiProvider(Provider):
+    def __init__(self, api_key: str, system_prompt: str, tools: list):
+        # Imported on first chat: the SDK takes longer to import than the rest of the app
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        # Built once and reused by every request
+        self.model = genai.GenerativeModel(GEMINI_MODEL, tools=tools, system_instruction=system_prompt)
+
+    async def stream(self, message: str, context: Optional[str] = None):
+        contents = [context, message] if context else message
+        response = await self.model.generate_content_async(contents, stream=True)
+        async for chunk in response:
+            for part in chunk.parts:
+                if part.function_call:
+                    fc = part.function_call
+                    yield ChatEvent(function_call=fc.name, args=dict(fc.args))
+                elif part.text:
+                    yield ChatEvent(text=part.text)
+
+
+class FakeProvider(Provider):
+    """Deterministic stand-in: echoes the message word by word.
+
+    "add <qty> <name> and <qty> <name>, ..." produces one `add_item_tool` call per item;
+    otherwise the reply notes how big the context was.
+    """
+
+    ADD_PATTERN = re.compile(r"^\s*add\s+(.+?)\s*$", re.IGNORECASE)
+    ADD_ITEM = re.compile(r"^(-?\d+)\s+(.+)$")
+    ADD_SEPARATOR = re.compile(r"\s*(?:,|\band\b)\s*", re.IGNORECASE)
+
+    def __init__(self, token_delay_ms: float = FAKE_TOKEN_DELAY_MS):
+        self.token_delay = token_delay_ms / 1000
+
+    async def stream(self, message: str, context: Optional[str] = None):
+        match = self.ADD_PATTERN.match(message)
+        if match:
+            for piece in self.ADD_SEPARATOR.split(match.group(1)):
+                item = self.ADD_ITEM.match(piece)
+                if item:
+                    yield ChatEvent(function_call="add_item_tool", args={
+                        "name": item.group(2),
+                        "quantity": int(item.group(1)),
+                        "category_slug": "misc",
+                    })
+            return
+        reply = f"STOCKMAN ECHO: {message}"
+        if context:
+            reply += f" [CONTEXT {len(context.splitlines())} LINES]"
+        for word in reply.split(" "):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield ChatEvent(text=word + " ")
+
+
+_provider = None
+
+
+def get_provider(system_prompt: str, tools: list) -> Optional[Provider]:
+    """The process-wide provider, created on first use. None if Gemini has no API key."""
+    global _provider
+    if _provider is None:
+        if AI_PROVIDER == "fake":
+            _provider = FakeProvider()
+        else:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                return None
+            _provider = GeminiProvider(api_key, system_prompt, tools)
+    return _provider
+
+
+class Overloaded(Exception):
+    """No upstream slot available: the queue is full or the wait timed out."""
+
+
+class Admission:
+    """Bounded admission queue in front of the provider.
+
+    At most `concurrency` calls run at once and at most `queue_depth` wait; anyone beyond
+    that (or waiting longer than `timeout` seconds) is turned away immediately.
+    """
+
+    def __init__(self, concurrency: int, queue_depth: int, timeout: float):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._slots = None
+
+    async def acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        if self.active >= self.concurrency and self.waiting >= self.queue_depth:
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+
+admission = Admission(AI_CONCURRENCY, AI_QUEUE_DEPTH, AI_QUEUE_TIMEOUT)
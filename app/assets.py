@@ -0,0 +1,209 @@
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+from urllib.parse import parse_qs
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+STATIC_DIR = "app/static"
+ICON_SUBDIR = "icons"
+
+# Files named by content hash (see icons.process_icon) never change under the same URL
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{32}(_\d+)?\.(png|webp)$")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Atlas written by `generate_icons.py sprite`
+SPRITE_ATLAS = "sprite/icons.json"
+_sprite = None
+
+# Static files precompressed at startup
+PRECOMPRESS = ["styles.css"]
+
+# (path) -> (mtime_ns, size, sha256 hex); content hashes are only recomputed when a file changes
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+# (icon dir mtime_ns, versions); dropped by invalidate_icons() after an icon write
+_icon_versions = None
+
+
+def file_hash(path: str, stat_result: os.stat_result = None) -> str:
+    if stat_result is None:
+        stat_result = os.stat(path)
+    key = (stat_result.st_mtime_ns, stat_result.st_size)
+    cached = _hashes.get(path)
+    if cached and cached[:2] == key:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            digest.update(block)
+    value = digest.hexdigest()
+    with _hashes_lock:
+        _hashes[path] = (*key, value)
+    return value
+
+
+def asset_url(path: str) -> str:
+    """Versioned URL for a file under app/static, e.g. asset_url("styles.css")."""
+    try:
+        version = file_hash(os.path.join(STATIC_DIR, path))[:12]
+    except OSError:
+        return f"/static/{path}"
+    return f"/static/{path}?v={version}"
+
+
+def icon_versions() -> dict:
+    """Version tokens for icons that are not content-addressed (built-in names like box.png).
+
+    The directory scan is cached; adding or replacing a file bumps the directory mtime,
+    and in-process writes call `invalidate_icons()` as well.
+    """
+    global _icon_versions
+    icon_dir = os.path.join(STATIC_DIR, ICON_SUBDIR)
+    try:
+        dir_mtime = os.stat(icon_dir).st_mtime_ns
+    except OSError:
+        return {}
+    cached = _icon_versions
+    if cached is not None and cached[0] == dir_mtime:
+        return cached[1]
+
+    versions = {}
+    with os.scandir(icon_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or CONTENT_ADDRESSED.match(entry.name):
+                continue
+            if not entry.name.endswith((".png", ".webp")):
+                continue
+            versions[entry.name] = file_hash(entry.path, entry.stat())[:12]
+    _icon_versions = (dir_mtime, versions)
+    return versions
+
+
+def invalidate_icons():
+    """Forget the cached icon scan; call after writing into the icon directory."""
+    global _icon_versions
+    _icon_versions = None
+
+
+def accepted_encodings(header: str) -> dict:
+    """Accept-Encoding as {coding: q}; a coding with q=0 is explicitly refused."""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def sprite_icons() -> list:
+    """Icon names packed into the sprite sheet (see `generate_icons.py sprite`), if built."""
+    path = os.path.join(STATIC_DIR, SPRITE_ATLAS)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return []
+    global _sprite
+    if _sprite is None or _sprite[0] != mtime:
+        with open(path) as f:
+            _sprite = (mtime, sorted(json.load(f)["icons"]))
+    return _sprite[1]
+
+
+def fingerprint() -> str:
+    """Short hash over the static files the index page references (stylesheet, icons, sprite)."""
+    parts = [asset_url("styles.css"), asset_url(SPRITE_ATLAS)]
+    parts.extend(f"{name}:{version}" for name, version in sorted(icon_versions().items()))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:12]
+
+
+def precompress(names=PRECOMPRESS, static_dir: str = STATIC_DIR):
+    """Write .gz (and .br when brotli is installed) next to each file if missing or stale."""
+    encoders = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.append((".br", lambda data: brotli.compress(data, quality=11)))
+
+    for name in names:
+        path = os.path.join(static_dir, name)
+        try:
+            source_mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+        data = None
+        for suffix, encode in encoders:
+            target = path + suffix
+            if os.path.exists(target) and os.stat(target).st_mtime_ns >= source_mtime:
+                continue
+            if data is None:
+                with open(path, "rb") as f:
+                    data = f.read()
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(encode(data))
+            os.replace(tmp_path, target)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with strong content ETags, immutable caching and precompressed variants.
+
+    - Content-addressed icons and `?v=`-versioned URLs are cached for a year as immutable.
+    - Everything else must revalidate, answered cheaply with 304 via the ETag.
+    - `<file>.br` / `<file>.gz` are served when present and accepted by the client.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        etag = file_hash(full_path, stat_result)
+
+        serve_path, serve_stat, encoding = full_path, stat_result, None
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        for enc, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if accepted.get(enc, accepted.get("*", 0)) > 0 and os.path.isfile(full_path + suffix):
+                serve_path = full_path + suffix
+                serve_stat = os.stat(serve_path)
+                encoding = enc
+                # Different bytes, different (still strong) validator
+                etag = f"{etag}-{enc}"
+                break
+
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        response = FileResponse(serve_path, status_code=status_code, stat_result=serve_stat, media_type=media_type)
+        response.headers["etag"] = f'"{etag}"'
+        response.headers["vary"] = "Accept-Encoding"
+        if encoding:
+            response.headers["content-encoding"] = encoding
+
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if CONTENT_ADDRESSED.match(os.path.basename(full_path)) or query.get("v"):
+            response.headers["cache-control"] = IMMUTABLE
+        else:
+            response.headers["cache-control"] = REVALIDATE
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import orjson
+
+# In-process change feed: routers publish mutations, /api/events streams them to browsers.
+# Publishing is safe from sync routes (thread pool) as well as from the event loop.
+# One process only; with several workers each one only sees its own writes.
+
+# Events buffered per subscriber; a client that falls further behind is told to resync
+SUBSCRIBER_QUEUE_SIZE = 256
+
+_lock = threading.Lock()
+_subscribers = set()
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def offer(self, event: dict):
+        # Runs on the subscriber's loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Dropping single events would leave the client silently wrong
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+def subscribe() -> Subscriber:
+    subscriber = Subscriber(asyncio.get_running_loop())
+    with _lock:
+        _subscribers.add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber: Subscriber):
+    with _lock:
+        _subscribers.discard(subscriber)
+
+
+def publish(event: dict):
+    """Send an event to every connected client. Call after the change is committed."""
+    with _lock:
+        subscribers = list(_subscribers)
+    for subscriber in subscribers:
+        try:
+            subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+        except RuntimeError:
+            # Loop already closed
+            unsubscribe(subscriber)
+
+
+def encode(event: dict) -> bytes:
+    # orjson handles the date fields of serialized items
+    return orjson.dumps(event)
+
+
+# Event shapes, shared by every publisher
+
+def item_upserted(item: dict):
+    publish({"type": "item", "op": "upsert", "item": item})
+
+
+def item_deleted(item_id: int):
+    publish({"type": "item", "op": "delete", "id": item_id})
+
+
+def items_reload():
+    """Many rows changed at once (bulk import, subcategory rename): clients refetch their view."""
+    publish({"type": "items", "op": "reload"})
+
+
+def taxonomy_changed(structure: dict):
+    publish({"type": "taxonomy", "structure": structure})
@@ -0,0 +1,432 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+import os
+
+# In-process caches for rarely changing, frequently read data.
+# Each cache is guarded by a version counter: writers bump the version,
+# readers rebuild lazily the next time they notice the version moved.
+
+_taxonomy_lock = threading.Lock()
+_taxonomy_version = 0
+_taxonomy = None
+
+# Single-flight locks for the async rebuild paths, created on first use inside the loop
+_async_locks = {}
+
+
+def _async_lock(name: str) -> asyncio.Lock:
+    lock = _async_locks.get(name)
+    if lock is None:
+        lock = _async_locks[name] = asyncio.Lock()
+    return lock
+
+
+DEFAULT_ICON = "pack_generic.png"
+
+
+class Taxonomy:
+    """Immutable snapshot of categories and subcategories."""
+
+    def __init__(self, version, categories, subcategories):
+        self.version = version
+        # Plain dicts so the snapshot never touches a (closed) session again
+        self.categories = categories
+        self.subcategories = subcategories
+
+        self.category_ids = {c["slug"]: c["id"] for c in categories}
+        # Items reference subcategories by id; their slug and icon are looked up here
+        self.subcategories_by_id = {sub["id"]: sub for sub in subcategories}
+        self.subcategory_ids_by_slug = {}
+        for sub in subcategories:
+            self.subcategory_ids_by_slug.setdefault(sub["slug"], []).append(sub["id"])
+
+        # Structure consumed by the index template (CAT_STRUCTURE)
+        self.structure = {}
+        for cat in categories:
+            self.structure[cat["slug"]] = {
+                "name": cat["name"],
+                "id": cat["id"],
+                "subs": {}
+            }
+        slug_by_id = {c["id"]: c["slug"] for c in categories}
+        for sub in subcategories:
+            cat_slug = slug_by_id.get(sub["category_id"])
+            if cat_slug is None:
+                continue
+            self.structure[cat_slug]["subs"][sub["slug"]] = {
+                "id": sub["id"],
+                "name": sub["name"],
+                "icon": sub["icon_path"]
+            }
+
+    def subcategory_ids(self, slug, category_id=None):
+        """Ids of the subcategories with this slug (slugs are only unique per category)."""
+        ids = self.subcategory_ids_by_slug.get(slug, [])
+        if category_id is not None:
+            ids = [i for i in ids if self.subcategories_by_id[i]["category_id"] == category_id]
+        return ids
+
+    def resolve_subcategory(self, slug, category_id=None):
+        """Id for a subcategory slug within the item's category; None if that category has none."""
+        ids = self.subcategory_ids(slug, category_id)
+        return ids[0] if ids else None
+
+    def subcategory_slug(self, subcategory_id):
+        sub = self.subcategories_by_id.get(subcategory_id)
+        return sub["slug"] if sub else None
+
+    def icon_for(self, subcategory_id):
+        """Icon of an item in this subcategory."""
+        sub = self.subcategories_by_id.get(subcategory_id)
+        return sub["icon_path"] if sub and sub["icon_path"] else DEFAULT_ICON
+
+
+def _build_taxonomy(db: Session, version: tuple) -> Taxonomy:
+    # Two flat queries instead of lazy-loading `cat.subcategories` per category
+    categories = [
+        {"id": c.id, "name": c.name, "slug": c.slug}
+        for c in db.query(models.Category).order_by(models.Category.id).all()
+    ]
+    subcategories = [
+        {"id": s.id, "name": s.name, "slug": s.slug, "icon_path": s.icon_path, "category_id": s.category_id}
+        for s in db.query(models.SubCategory).order_by(models.SubCategory.id).all()
+    ]
+    return Taxonomy(version, categories, subcategories)
+
+
+# Newest change-log seq of a category or subcategory (see migrations). Writes from any worker
+# move it, while item writes don't; both lookups are a single probe of ix_changes_entity_seq.
+TAXONOMY_SEQ_SQL = text(
+    "SELECT MAX("
+    "COALESCE((SELECT MAX(seq) FROM changes WHERE entity = 'category'), 0), "
+    "COALESCE((SELECT MAX(seq) FROM changes WHERE entity = 'subcategory'), 0))"
+)
+
+
+def get_taxonomy(db: Session) -> Taxonomy:
+    """Return the cached taxonomy, rebuilding it if it was invalidated here or changed in the database."""
+    global _taxonomy
+    version = (_taxonomy_version, db.execute(TAXONOMY_SEQ_SQL).scalar())
+    snapshot = _taxonomy
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _taxonomy_lock:
+        # Another thread may have rebuilt it while we waited
+        if _taxonomy is None or _taxonomy.version != version:
+            _taxonomy = _build_taxonomy(db, version)
+        return _taxonomy
+
+
+async def get_taxonomy_async(db: AsyncSession) -> Taxonomy:
+    """`get_taxonomy` for async sessions; one indexed lookup unless it has to rebuild."""
+    global _taxonomy
+    version = (_taxonomy_version, (await db.execute(TAXONOMY_SEQ_SQL)).scalar())
+    snapshot = _taxonomy
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    # run_sync executes on the event loop thread and yields to it on every query, so
+    # it must not wait on _taxonomy_lock (another coroutine on this thread may hold it)
+    async with _async_lock("taxonomy"):
+        if _taxonomy is None or _taxonomy.version != version:
+            _taxonomy = await db.run_sync(_build_taxonomy, version)
+        return _taxonomy
+
+
+def invalidate_taxonomy():
+    """Mark the taxonomy cache stale. Call after committing category/subcategory changes."""
+    global _taxonomy_version
+    with _taxonomy_lock:
+        _taxonomy_version += 1
+
+
+# Inventory (items) version: bumped after every committed item write
+
+_inventory_lock = threading.Lock()
+_inventory_version = 0
+
+
+def invalidate_inventory():
+    """Mark item-derived caches stale. Call after committing item changes."""
+    global _inventory_version
+    with _inventory_lock:
+        _inventory_version += 1
+
+
+# Highest seq ever handed out by the change log (see migrations). It lives in the database,
+# so every worker process sees the same value, and it only grows: log rows are replaced,
+# but AUTOINCREMENT never reuses a seq.
+CHANGE_SEQ_SQL = text("SELECT seq FROM sqlite_sequence WHERE name = 'changes'")
+_seen_change_seq = None
+
+
+def _observe_change_seq(seq: int) -> str:
+    global _seen_change_seq
+    if _seen_change_seq is not None and seq != _seen_change_seq:
+        # Possibly another worker's write: the inventory version is per process
+        # (the taxonomy checks the database itself, see get_taxonomy)
+        invalidate_inventory()
+    _seen_change_seq = seq
+    return str(seq)
+
+
+def data_version(db: Session) -> str:
+    """Global version of everything served from the database, for ETags. Changes on every write."""
+    return _observe_change_seq(db.execute(CHANGE_SEQ_SQL).scalar() or 0)
+
+
+async def data_version_async(db: AsyncSession) -> str:
+    """`data_version` for async sessions."""
+    return _observe_change_seq((await db.execute(CHANGE_SEQ_SQL)).scalar() or 0)
+
+
+# Watchlist: counts behind the dashboard badge (expiring soon / below target)
+
+# Items expiring within this many days count as "expiring"
+WATCHLIST_DAYS = 7
+# Rebuilt at least this often even without writes, since "today" moves on
+WATCHLIST_TTL_SECONDS = 300
+
+_watchlist_lock = threading.Lock()
+_watchlist = None
+
+
+def get_watchlist(db: Session) -> dict:
+    """Return cached watchlist counts, recounting only after item writes or the TTL."""
+    global _watchlist
+    now = time.monotonic()
+    snapshot = _watchlist
+    if snapshot is not None and snapshot["version"] == _inventory_version and snapshot["expires_at"] > now:
+        return snapshot["data"]
+
+    with _watchlist_lock:
+        version = _inventory_version
+        if _watchlist is None or _watchlist["version"] != version or _watchlist["expires_at"] <= now:
+            today = date.today()
+            data = {
+                "expiring": db.query(func.count(models.Item.id)).filter(
+                    models.Item.expiry_date >= today,
+                    models.Item.expiry_date <= today + timedelta(days=WATCHLIST_DAYS)
+                ).scalar(),
+                # Same predicate as the partial index ix_items_shortfall
+                "shortfall": db.query(func.count(models.Item.id)).filter(
+                    models.Item.quantity < models.Item.target_quantity
+                ).scalar(),
+                "days": WATCHLIST_DAYS,
+                "as_of": today.isoformat(),
+            }
+            _watchlist = {"version": version, "expires_at": now + WATCHLIST_TTL_SECONDS, "data": data}
+        return _watchlist["data"]
+
+
+# Inventory summary: compact stock context for the AI quartermaster
+
+# Prompt budget for the summary; tokens are estimated at ~4 characters each
+SUMMARY_TOKEN_BUDGET = int(os.getenv("WAREHOUSE_AI_CONTEXT_TOKENS", "1500"))
+# Items named per subcategory line (largest stock first); the rest only count
+SUMMARY_ITEMS_PER_GROUP = 5
+# Expiring / low-stock items listed before the per-subcategory overview
+SUMMARY_PRIORITY_LIMIT = 25
+
+_summary = None
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _fit(lines, budget: int):
+    """Leading lines that fit in `budget` tokens (plus an omission note); returns (lines, tokens used)."""
+    kept, used = [], 0
+    for index, line in enumerate(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            kept.append(f"... ({len(lines) - index} more lines omitted)")
+            used += cost
+            break
+        kept.append(line)
+        used += cost
+    return kept, used
+
+
+def _build_inventory_summary(db: Session, budget: int, taxonomy: Taxonomy) -> str:
+    # The caller resolves the taxonomy: under run_sync this runs on the loop thread,
+    # where taking the taxonomy's threading lock could deadlock
+    Item = models.Item
+    category_names = {c["id"]: c["name"] for c in taxonomy.categories}
+    sub_names = {sub["id"]: sub["name"] for sub in taxonomy.subcategories}
+    today = date.today()
+    lines = []
+
+    expiring = db.execute(
+        select(Item.name, Item.quantity, Item.expiry_date)
+        .where(Item.expiry_date <= today + timedelta(days=WATCHLIST_DAYS))
+        .order_by(Item.expiry_date, Item.id)
+        .limit(SUMMARY_PRIORITY_LIMIT)
+    ).all()
+    if expiring:
+        lines.append(f"USE FIRST (expires within {WATCHLIST_DAYS} days or expired):")
+        lines.extend(f"- {name} x{qty} (exp {exp.isoformat()})" for name, qty, exp in expiring)
+
+    low = db.execute(
+        select(Item.name, Item.quantity, Item.target_quantity)
+        .where(Item.quantity < Item.target_quantity)
+        .order_by((Item.target_quantity - Item.quantity).desc(), Item.id)
+        .limit(SUMMARY_PRIORITY_LIMIT)
+    ).all()
+    if low:
+        lines.append("LOW STOCK:")
+        lines.extend(f"- {name} x{qty}/{target}" for name, qty, target in low)
+
+    # Priority sections get up to half the budget, the overview the rest
+    summary, used = _fit(lines, budget // 2)
+    lines = []
+
+    # One aggregate row per (category, subcategory) ...
+    groups = db.execute(
+        select(Item.category_id, Item.subcategory_id, func.count(Item.id), func.sum(Item.quantity))
+        .group_by(Item.category_id, Item.subcategory_id)
+        .order_by(Item.category_id, Item.subcategory_id)
+    ).all()
+    # ... plus the largest few items of each, picked in SQL with a window function
+    rank = func.row_number().over(
+        partition_by=(Item.category_id, Item.subcategory_id),
+        order_by=(Item.quantity.desc(), Item.id)
+    ).label("rank")
+    ranked = select(Item.category_id, Item.subcategory_id, Item.name, Item.quantity, rank).subquery()
+    top = {}
+    for cat_id, sub, name, qty in db.execute(
+        select(ranked.c.category_id, ranked.c.subcategory_id, ranked.c.name, ranked.c.quantity)
+        .where(ranked.c.rank <= SUMMARY_ITEMS_PER_GROUP)
+        .order_by(ranked.c.category_id, ranked.c.subcategory_id, ranked.c.rank)
+    ):
+        top.setdefault((cat_id, sub), []).append(f"{name} {qty}")
+
+    if groups:
+        lines.append("STOCK (kinds, units: largest items):")
+    for cat_id, sub, kinds, units in groups:
+        label = category_names.get(cat_id, "Other")
+        if sub:
+            label = f"{label}/{sub_names.get(sub, '?')}"
+        names = ", ".join(top.get((cat_id, sub), []))
+        more = f", +{kinds - SUMMARY_ITEMS_PER_GROUP} more" if kinds > SUMMARY_ITEMS_PER_GROUP else ""
+        lines.append(f"- {label}: {kinds} kinds, {units or 0} units: {names}{more}")
+
+    overview, _ = _fit(lines, budget - used)
+    summary.extend(overview)
+    if not summary:
+        return "Inventory is empty."
+    return "\n".join(summary)
+
+
+async def get_inventory_summary_async(db: AsyncSession) -> str:
+    """Cached inventory summary within SUMMARY_TOKEN_BUDGET; rebuilt after item writes or the TTL.
+
+    Only touches the database on a rebuild.
+    """
+    global _summary
+    snapshot = _summary
+    if snapshot is not None and snapshot["version"] == _inventory_version and snapshot["expires_at"] > time.monotonic():
+        return snapshot["text"]
+
+    # Same reason as get_taxonomy_async: a threading lock could deadlock the loop thread
+    async with _async_lock("summary"):
+        now = time.monotonic()
+        version = _inventory_version
+        if _summary is None or _summary["version"] != version or _summary["expires_at"] <= now:
+            taxonomy = await get_taxonomy_async(db)
+            text = await db.run_sync(_build_inventory_summary, SUMMARY_TOKEN_BUDGET, taxonomy)
+            # Expiry windows move with the date, like the watchlist
+            _summary = {"version": version, "expires_at": now + WATCHLIST_TTL_SECONDS, "text": text}
+        return _summary["text"]
+
+
+# Session principals: user_id -> schemas.User (or None for a stale session)
+
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL_SECONDS = 300
+
+_users_lock = threading.Lock()
+_users = OrderedDict()
+# Set once an admin is known to exist; admins are never removed
+_admin_exists = False
+
+
+def get_user(user_id: int):
+    """Return (found, principal) for a cached session user."""
+    with _users_lock:
+        entry = _users.get(user_id)
+        if entry is None:
+            return False, None
+        expires_at, principal = entry
+        if expires_at <= time.monotonic():
+            del _users[user_id]
+            return False, None
+        _users.move_to_end(user_id)
+        return True, principal
+
+
+def put_user(user_id: int, principal):
+    with _users_lock:
+        _users[user_id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, principal)
+        _users.move_to_end(user_id)
+        while len(_users) > USER_CACHE_SIZE:
+            _users.popitem(last=False)
+
+
+def invalidate_users():
+    """Drop all cached principals. Call after committing user changes."""
+    with _users_lock:
+        _users.clear()
+
+
+def admin_exists() -> bool:
+    return _admin_exists
+
+
+def mark_admin_exists():
+    global _admin_exists
+    _admin_exists = True
+
+
+# AI replies to non-mutating prompts: (normalized message, inventory version) -> text
+
+AI_CACHE_SIZE = int(os.getenv("WAREHOUSE_AI_CACHE_SIZE", "256"))
+AI_CACHE_TTL_SECONDS = int(os.getenv("WAREHOUSE_AI_CACHE_TTL", "600"))
+
+_ai_lock = threading.Lock()
+_ai_responses = OrderedDict()
+
+
+def ai_response_key(message: str):
+    # Item writes change the inventory the reply was based on, so they change the key
+    return " ".join(message.split()), _inventory_version
+
+
+def get_ai_response(key):
+    with _ai_lock:
+        entry = _ai_responses.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at <= time.monotonic():
+            del _ai_responses[key]
+            return None
+        _ai_responses.move_to_end(key)
+        return text
+
+
+def put_ai_response(key, text: str):
+    with _ai_lock:
+        _ai_responses[key] = (time.monotonic() + AI_CACHE_TTL_SECONDS, text)
+        _ai_responses.move_to_end(key)
+        while len(_ai_responses) > AI_CACHE_SIZE:
+            _ai_responses.popitem(last=False)
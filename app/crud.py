@@ -1,49 +1,366 @@
-from sqlalchemy.orm import Session
-from . import models, schemas
+from sqlalchemy import or_, and_, update, delete, case, insert, select, text
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, List
+from datetime import date, timedelta
+from . import models, schemas, cache
 import hashlib
+import re
 
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
+async def get_user_async(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+def admin_exists(db: Session) -> bool:
+    # Memoized once true: setup only ever adds the first admin
+    if cache.admin_exists():
+        return True
+    if db.query(models.User.id).filter(models.User.is_admin == True).first() is None:
+        return False
+    cache.mark_admin_exists()
+    return True
+
+async def admin_exists_async(db: AsyncSession) -> bool:
+    if cache.admin_exists():
+        return True
+    result = await db.execute(select(models.User.id).where(models.User.is_admin == True).limit(1))
+    if result.first() is None:
+        return False
+    cache.mark_admin_exists()
+    return True
+
 def create_user(db: Session, user: schemas.UserCreate, is_admin: bool = False):
     fake_hashed_password = hashlib.sha256(user.password.encode()).hexdigest()
     db_user = models.User(username=user.username, hashed_password=fake_hashed_password, is_admin=is_admin)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    cache.invalidate_users()
+    if is_admin:
+        cache.mark_admin_exists()
     return db_user
 
-def get_items(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Item).offset(skip).limit(limit).all()
+def get_items(
+    db: Session,
+    limit: int = 100,
+    after: Optional[tuple] = None,
+    sort: str = "id",
+    category_id: Optional[int] = None,
+    subcategory: Optional[str] = None,
+    subcategory_id: Optional[int] = None,
+    low_stock: bool = False,
+    expires_from: Optional[date] = None,
+    expires_to: Optional[date] = None,
+    name_prefix: Optional[str] = None,
+    with_category: bool = False,
+):
+    """Keyset-paginated item listing.
+
+    `after` is the sort key of the last row of the previous page:
+    `(id,)` when sorting by id, `(name, id)` when sorting by name.
+    `with_category` loads each item's category in one extra query.
+    """
+    query = db.query(models.Item)
+    if with_category:
+        query = query.options(selectinload(models.Item.category))
+
+    if category_id is not None:
+        query = query.filter(models.Item.category_id == category_id)
+    if subcategory_id is not None:
+        query = query.filter(models.Item.subcategory_id == subcategory_id)
+    elif subcategory:
+        ids = cache.get_taxonomy(db).subcategory_ids(subcategory, category_id)
+        if not ids:
+            return []
+        query = query.filter(models.Item.subcategory_id.in_(ids))
+    if low_stock:
+        query = query.filter(models.Item.quantity < models.Item.target_quantity)
+    if expires_from is not None:
+        query = query.filter(models.Item.expiry_date >= expires_from)
+    if expires_to is not None:
+        query = query.filter(models.Item.expiry_date <= expires_to)
+    if name_prefix:
+        # Range scan instead of LIKE so the name index is usable
+        query = query.filter(
+            models.Item.name >= name_prefix,
+            models.Item.name < name_prefix + "\U0010ffff"
+        )
+
+    if sort == "name":
+        if after:
+            last_name, last_id = after
+            query = query.filter(or_(
+                models.Item.name > last_name,
+                and_(models.Item.name == last_name, models.Item.id > last_id)
+            ))
+        query = query.order_by(models.Item.name, models.Item.id)
+    else:
+        if after:
+            query = query.filter(models.Item.id > after[0])
+        query = query.order_by(models.Item.id)
+
+    return query.limit(limit).all()
 
 from . import mappings
 
 
+class UnknownSubcategory(ValueError):
+    pass
+
+
+def _resolve_subcategory(taxonomy: cache.Taxonomy, subcategory_id: Optional[int], slug: Optional[str], category_id: Optional[int]):
+    # An item's subcategory must belong to the item's category (when it has one)
+    if subcategory_id is not None:
+        sub = taxonomy.subcategories_by_id.get(subcategory_id)
+        if sub is None:
+            raise UnknownSubcategory(f"Unknown subcategory id {subcategory_id}")
+        if category_id is not None and sub["category_id"] != category_id:
+            raise UnknownSubcategory(f"Subcategory {subcategory_id} is not in category {category_id}")
+        return subcategory_id
+    if not slug:
+        return None
+    resolved = taxonomy.resolve_subcategory(slug, category_id)
+    if resolved is None:
+        raise UnknownSubcategory(f"Unknown subcategory '{slug}' in category {category_id}")
+    return resolved
+
+
+def item_values(item: schemas.ItemCreate, taxonomy: cache.Taxonomy) -> dict:
+    """Column values for a new item row; raises UnknownSubcategory."""
+    values = item.dict(exclude={"subcategory"})
+    values["subcategory_id"] = _resolve_subcategory(taxonomy, item.subcategory_id, item.subcategory, item.category_id)
+    return values
+
+
+# Stored columns of the API item; subcategory (slug) and icon_type come from the taxonomy
+ITEM_COLUMNS = [f for f in schemas.Item.model_fields if f not in ("subcategory", "icon_type")]
+
+
+def item_dict(item: models.Item, taxonomy: cache.Taxonomy) -> dict:
+    """schemas.Item-shaped dict, built straight from ORM attributes (no per-item validation)."""
+    data = {field: getattr(item, field) for field in ITEM_COLUMNS}
+    data["subcategory"] = taxonomy.subcategory_slug(item.subcategory_id)
+    data["icon_type"] = taxonomy.icon_for(item.subcategory_id)
+    return data
+
+
 def create_item(db: Session, item: schemas.ItemCreate):
-    # Auto-assign icon based on subcategory from database
-    icon_type = "pack_generic.png"  # Default
-    
-    if item.subcategory:
-        # Try to get icon from database subcategory
-        subcategory_obj = db.query(models.SubCategory).filter(
-            models.SubCategory.slug == item.subcategory
-        ).first()
-        
-        if subcategory_obj and subcategory_obj.icon_path:
-            icon_type = subcategory_obj.icon_path
-        elif item.subcategory in mappings.ICON_MAPPING:
-            # Fallback to static mapping
-            icon_type = mappings.ICON_MAPPING[item.subcategory]
-    
-    item.icon_type = icon_type
-    
-    db_item = models.Item(**item.dict())
+    db_item = models.Item(**item_values(item, cache.get_taxonomy(db)))
     db.add(db_item)
     db.commit()
     db.refresh(db_item)
+    cache.invalidate_inventory()
     return db_item
 
 
+def create_items(db: Session, items: List[schemas.ItemCreate], taxonomy: cache.Taxonomy = None):
+    """Create several items in one transaction (all or nothing)."""
+    taxonomy = taxonomy or cache.get_taxonomy(db)
+    db_items = [models.Item(**item_values(item, taxonomy)) for item in items]
+    db.add_all(db_items)
+    db.commit()
+    cache.invalidate_inventory()
+    return db_items
+
+
+def set_item_quantity(db: Session, item_id: int, quantity: int):
+    # One UPDATE ... RETURNING like update_item: a load-then-flush would race
+    # concurrent adjustments and fail the ORM version check
+    stmt = (
+        update(models.Item)
+        .where(models.Item.id == item_id)
+        .values(quantity=quantity, version=models.Item.version + 1)
+        .returning(models.Item)
+    )
+    db_item = db.execute(stmt).scalar_one_or_none()
+    if db_item is None:
+        db.rollback()
+        return None
+    db.commit()
+    cache.invalidate_inventory()
+    return db_item
+
+
+def delete_item(db: Session, item_id: int) -> bool:
+    deleted = db.execute(delete(models.Item).where(models.Item.id == item_id)).rowcount
+    if not deleted:
+        db.rollback()
+        return False
+    db.commit()
+    cache.invalidate_inventory()
+    return True
+
+
+def get_expiring_items(db: Session, days: int, limit: int = 100):
+    """Items whose expiry date falls between today and `days` from now, soonest first."""
+    today = date.today()
+    return db.query(models.Item).filter(
+        models.Item.expiry_date >= today,
+        models.Item.expiry_date <= today + timedelta(days=days)
+    ).order_by(models.Item.expiry_date, models.Item.id).limit(limit).all()
+
+
+# Most recent matches considered for ranking by /api/items/search
+SEARCH_RANK_WINDOW = 1000
+
+
+def _fts_query(q: str) -> Optional[str]:
+    # Every word must match as a prefix, in the name or its transliteration; words are
+    # reduced to \w+ so FTS5 syntax in user input can't break the query
+    terms = []
+    for word in re.findall(r"\w+", q.lower()):
+        forms = dict.fromkeys((word, mappings.search_transliteration(word)))
+        terms.append("(" + " OR ".join(f'"{form}"*' for form in forms) + ")")
+    return " AND ".join(terms) or None
+
+
+def search_items(db: Session, q: str, limit: int = 20):
+    """Items whose name matches every word of `q` by prefix, best match first."""
+    match = _fts_query(q)
+    if match is None:
+        return []
+    # bm25 costs a few microseconds per hit, so a short prefix matching thousands of
+    # rows is only ranked over its newest SEARCH_RANK_WINDOW hits
+    statement = text(
+        "SELECT items.* FROM ("
+        "SELECT rowid, rank FROM items_fts WHERE items_fts MATCH :match ORDER BY rowid DESC LIMIT :window"
+        ") AS hits JOIN items ON items.id = hits.rowid ORDER BY hits.rank, items.id DESC LIMIT :limit"
+    )
+    return db.query(models.Item).from_statement(statement).params(
+        match=match, window=SEARCH_RANK_WINDOW, limit=limit
+    ).all()
+
+
+def get_shortfall_items(db: Session, limit: int = 100):
+    """Items below their target quantity, biggest shortfall first."""
+    return db.query(models.Item).filter(
+        models.Item.quantity < models.Item.target_quantity
+    ).order_by(
+        (models.Item.target_quantity - models.Item.quantity).desc(), models.Item.id
+    ).limit(limit).all()
+
+
+class VersionConflict(Exception):
+    def __init__(self, current_version: int):
+        self.current_version = current_version
+
+
+def update_item(db: Session, item_id: int, changes: schemas.ItemUpdate):
+    """Apply a partial update in a single UPDATE ... RETURNING statement.
+
+    Returns None if the item does not exist; raises VersionConflict if
+    `changes.version` is set and no longer matches the stored row, and
+    UnknownSubcategory for a subcategory that doesn't exist in the item's category.
+    A category change alone clears a subcategory of the old category.
+    """
+    values = changes.dict(exclude_unset=True)
+    expected_version = values.pop("version", None)
+
+    stmt = update(models.Item).where(models.Item.id == item_id)
+    if expected_version is not None:
+        stmt = stmt.where(models.Item.version == expected_version)
+
+    if "subcategory" in values or "subcategory_id" in values:
+        if "category_id" in values:
+            category_id = values["category_id"]
+        else:
+            # Checked against the stored category, which must still hold when the UPDATE runs
+            row = db.execute(select(models.Item.category_id).where(models.Item.id == item_id)).first()
+            if row is None:
+                return None
+            category_id = row.category_id
+            stmt = stmt.where(models.Item.category_id.is_(category_id))
+        values["subcategory_id"] = _resolve_subcategory(
+            cache.get_taxonomy(db), values.get("subcategory_id"), values.get("subcategory"), category_id
+        )
+    elif values.get("category_id") is not None:
+        # Moving to another category drops a subcategory that belongs to the old one
+        in_category = [
+            sub["id"] for sub in cache.get_taxonomy(db).subcategories if sub["category_id"] == values["category_id"]
+        ]
+        values["subcategory_id"] = case(
+            (models.Item.subcategory_id.in_(in_category), models.Item.subcategory_id), else_=None
+        )
+    values.pop("subcategory", None)
+    if "name" in values:
+        # Keep the search column in step (see models.Item.name_translit)
+        values["name_translit"] = mappings.search_transliteration(values["name"] or "")
+    stmt = stmt.values(**values, version=models.Item.version + 1).returning(models.Item)
+
+    db_item = db.execute(stmt).scalar_one_or_none()
+    if db_item is None:
+        db.rollback()
+        current = db.query(models.Item.version).filter(models.Item.id == item_id).scalar()
+        if current is None:
+            return None
+        raise VersionConflict(current)
+
+    db.commit()
+    cache.invalidate_inventory()
+    return db_item
+
+
+def _adjust_quantity(db: Session, item_id: int, delta: int):
+    # quantity = max(quantity + delta, 0), computed by the database so
+    # concurrent scanners can't overwrite each other's counts
+    new_quantity = models.Item.quantity + delta
+    stmt = (
+        update(models.Item)
+        .where(models.Item.id == item_id)
+        .values(
+            quantity=case((new_quantity < 0, 0), else_=new_quantity),
+            version=models.Item.version + 1
+        )
+        .returning(models.Item)
+    )
+    return db.execute(stmt).scalar_one_or_none()
+
+
+def adjust_item_quantity(db: Session, item_id: int, delta: int):
+    """Atomically add `delta` to an item's quantity. Returns None if the item does not exist."""
+    db_item = _adjust_quantity(db, item_id, delta)
+    if db_item is None:
+        db.rollback()
+        return None
+    db.commit()
+    cache.invalidate_inventory()
+    return db_item
+
+
+def adjust_item_quantities(db: Session, adjustments: List[schemas.StockAdjustment]):
+    """Apply many deltas in one transaction.
+
+    Returns (updated_items, missing_ids); nothing is committed if any id is missing.
+    """
+    updated = []
+    missing = []
+    for adj in adjustments:
+        db_item = _adjust_quantity(db, adj.id, adj.delta)
+        if db_item is None:
+            missing.append(adj.id)
+        else:
+            updated.append(db_item)
+
+    if missing:
+        db.rollback()
+        return [], missing
+    db.commit()
+    cache.invalidate_inventory()
+    return updated, []
+
+
+def bulk_insert_items(db: Session, rows: List[dict]):
+    """Insert pre-validated item rows with one executemany and commit them as one transaction."""
+    if not rows:
+        return 0
+    db.execute(insert(models.Item), rows)
+    db.commit()
+    cache.invalidate_inventory()
+    return len(rows)
+
+
 def init_categories(db: Session):
     # Check if categories exist
     if not db.query(models.Category).first():
@@ -76,10 +393,12 @@ def init_categories(db: Session):
                 )
                 db.add(db_sub)
         db.commit()
+    cache.invalidate_taxonomy()
 
 def create_subcategory(db: Session, sub: schemas.SubCategoryCreate):
     db_sub = models.SubCategory(**sub.dict())
     db.add(db_sub)
     db.commit()
     db.refresh(db_sub)
+    cache.invalidate_taxonomy()
     return db_sub
@@ -1,13 +1,120 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql.dml import UpdateBase
+import os
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./warehouse.db"
+# Engine profile, overridable from the environment
+SQLALCHEMY_DATABASE_URL = os.getenv("WAREHOUSE_DATABASE_URL", "sqlite:///./warehouse.db")
+# Same database through aiosqlite, for `async def` routes
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv(
+    "WAREHOUSE_ASYNC_DATABASE_URL",
+    SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+)
+
+# Reader pool. Writes go through one connection per engine: sync routes and async
+# routes each have their own writer, so at most two write transactions wait on
+# SQLite's lock at once, which busy_timeout absorbs
+DB_POOL_SIZE = int(os.getenv("WAREHOUSE_DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("WAREHOUSE_DB_MAX_OVERFLOW", "10"))
+# Seconds a writer waits for its engine's write connection before giving up
+DB_WRITE_TIMEOUT = float(os.getenv("WAREHOUSE_DB_WRITE_TIMEOUT", "30"))
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("WAREHOUSE_SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("WAREHOUSE_SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("WAREHOUSE_SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    # Negative cache_size is in KiB
+    "cache_size": int(os.getenv("WAREHOUSE_SQLITE_CACHE_SIZE", "-20000")),
+    "mmap_size": int(os.getenv("WAREHOUSE_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+}
+
+_url = make_url(SQLALCHEMY_DATABASE_URL)
+IS_SQLITE = _url.get_backend_name() == "sqlite"
+
+# The sync and async engines open their own connections, so an in-memory database
+# would be two different empty databases; fail fast instead of 500ing on every query
+if IS_SQLITE and (
+    _url.database in (None, "", ":memory:")
+    or "mode=memory" in _url.database
+    or _url.query.get("mode") == "memory"
+):
+    raise RuntimeError(
+        f"In-memory SQLite ({SQLALCHEMY_DATABASE_URL}) is not supported: the sync and async engines "
+        "would each see their own database. Point WAREHOUSE_DATABASE_URL at a file (e.g. on a tmpfs)."
+    )
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def _engine_kwargs(pool_size: int, max_overflow: int, pool_timeout: float = 30):
+    kwargs = {"pool_size": pool_size, "max_overflow": max_overflow, "pool_timeout": pool_timeout}
+    if IS_SQLITE:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    return kwargs
+
+
+def _make_engines(factory, url):
+    reader = factory(url, **_engine_kwargs(DB_POOL_SIZE, DB_MAX_OVERFLOW))
+    # pool_size=1 / max_overflow=0 turns the pool into this engine's writer queue
+    writer = factory(url, **_engine_kwargs(1, 0, DB_WRITE_TIMEOUT))
+    if IS_SQLITE:
+        for e in {reader, writer}:
+            sync_engine = getattr(e, "sync_engine", e)
+            event.listen(sync_engine, "connect", _apply_sqlite_pragmas)
+    return reader, writer
+
+
+engine, write_engine = _make_engines(create_engine, SQLALCHEMY_DATABASE_URL)
+async_engine, async_write_engine = _make_engines(create_async_engine, ASYNC_SQLALCHEMY_DATABASE_URL)
+
+
+class RoutingSession(Session):
+    """Session that reads from the reader pool and writes through the writer connection.
+
+    Once a transaction has written, it sticks to the writer so it reads its own writes.
+    """
+    reader = None
+    writer = None
+    _use_writer = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._use_writer or self._flushing or isinstance(clause, UpdateBase):
+            self._use_writer = True
+            return self.writer
+        return self.reader
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _release_writer(session, transaction):
+    if transaction.parent is None:
+        session._use_writer = False
+
+
+class SyncRoutingSession(RoutingSession):
+    reader = engine
+    writer = write_engine
+
+
+class AsyncRoutingSession(RoutingSession):
+    reader = async_engine.sync_engine
+    writer = async_write_engine.sync_engine
+
+
+SessionLocal = sessionmaker(class_=SyncRoutingSession, autocommit=False, autoflush=False)
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Objects stay usable after commit: async sessions can't lazy-refresh expired attributes
+AsyncSessionLocal = async_sessionmaker(
+    sync_session_class=AsyncRoutingSession, autoflush=False, expire_on_commit=False
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
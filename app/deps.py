@@ -1,7 +1,6 @@
-from fastapi import Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
-from . import crud, database, models
-import hashlib
+from fastapi import Depends, HTTPException, status, Request, Response
+from typing import Optional
+from . import crud, database, schemas, cache
 
 def get_db():
     db = database.SessionLocal()
@@ -10,14 +9,39 @@ def get_db():
     finally:
         db.close()
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)):
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+async def get_current_user(request: Request) -> Optional[schemas.User]:
     user_id = request.session.get("user_id")
     if not user_id:
         return None
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    # Cached principal (schemas.User); a session is opened only on a miss and closed
+    # right away, not held for the rest of the request (e.g. a slow AI call)
+    found, user = cache.get_user(user_id)
+    if found:
+        return user
+    async with database.AsyncSessionLocal() as db:
+        db_user = await crud.get_user_async(db, user_id)
+    user = schemas.User.from_orm(db_user) if db_user else None
+    cache.put_user(user_id, user)
     return user
 
-def require_admin(user: models.User = Depends(get_current_user)):
+def require_admin(user: Optional[schemas.User] = Depends(get_current_user)) -> schemas.User:
     if not user or not user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
     return user
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if the client's If-None-Match already names `etag` (weak comparison, as for GET)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": cache_control})
@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from . import metrics, assets
+
+ICON_DIR = "app/static/icons"
+
+# Largest size is the main icon (what icon_path points at); the others are variants
+ICON_SIZES = (256, 128, 64)
+# Worker processes for decoding/resizing; uploads beyond QUEUE_LIMIT wait their turn
+ICON_WORKERS = int(os.getenv("WAREHOUSE_ICON_WORKERS", "2"))
+ICON_QUEUE_LIMIT = int(os.getenv("WAREHOUSE_ICON_QUEUE_LIMIT", str(ICON_WORKERS * 4)))
+
+_pool = None
+_queue_slots = None
+
+
+def icon_name(image_bytes: bytes) -> str:
+    """Content-addressed base name: the same upload always maps to the same files."""
+    return hashlib.sha256(image_bytes).hexdigest()[:32]
+
+
+def _save_atomic(img: Image.Image, path: str, fmt: str, **options):
+    # Concurrent uploads of the same image race to the same names; never expose half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    img.save(tmp_path, fmt, **options)
+    os.replace(tmp_path, path)
+
+
+def process_icon(image_bytes: bytes, icon_dir: str = ICON_DIR) -> str:
+    """Decode once and write every variant; returns the main icon filename.
+
+    Writes `<hash>.png` (256px), `<hash>_128.png`, `<hash>_64.png` and `<hash>.webp`.
+    Runs in a worker process; raises on undecodable input.
+    """
+    base = icon_name(image_bytes)
+    filename = f"{base}.png"
+    main_path = os.path.join(icon_dir, filename)
+    # The main file is written last, so its presence means the set is complete
+    if os.path.exists(main_path):
+        return filename
+
+    img = Image.open(io.BytesIO(image_bytes))
+    # Let JPEG decode at reduced scale: phone photos are far bigger than 256px
+    img.draft("RGB", (ICON_SIZES[0] * 2, ICON_SIZES[0] * 2))
+    img = img.convert("RGBA")
+
+    os.makedirs(icon_dir, exist_ok=True)
+    main = img.copy()
+    main.thumbnail((ICON_SIZES[0], ICON_SIZES[0]), Image.Resampling.LANCZOS)
+    _save_atomic(main, os.path.join(icon_dir, f"{base}.webp"), "WEBP", quality=85, method=4)
+
+    # Downscale each variant from the previous one instead of the full-size source
+    variant = main
+    for size in ICON_SIZES[1:]:
+        variant = variant.copy()
+        variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+        _save_atomic(variant, os.path.join(icon_dir, f"{base}_{size}.png"), "PNG", optimize=True)
+
+    _save_atomic(main, main_path, "PNG", optimize=True)
+    return filename
+
+
+def _process_icon_timed(image_bytes: bytes):
+    """`process_icon` in the worker, with the worker-side duration (no queueing or pool start-up).
+
+    Returns (filename, seconds, error); the error is handed back rather than raised so
+    failed uploads are timed too.
+    """
+    start = time.perf_counter()
+    try:
+        return process_icon(image_bytes), time.perf_counter() - start, None
+    except Exception as e:
+        return None, time.perf_counter() - start, e
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a threaded server process is not safe
+        _pool = ProcessPoolExecutor(
+            max_workers=ICON_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+async def process_icon_async(image_bytes: bytes) -> str:
+    """Run `process_icon` in the process pool without blocking the event loop."""
+    global _queue_slots
+    if _queue_slots is None:
+        _queue_slots = asyncio.Semaphore(ICON_QUEUE_LIMIT)
+    async with _queue_slots:
+        loop = asyncio.get_running_loop()
+        try:
+            filename, seconds, error = await loop.run_in_executor(_get_pool(), _process_icon_timed, image_bytes)
+        except BrokenProcessPool:
+            # A crashed worker poisons the pool; start a fresh one for the next upload
+            shutdown()
+            raise
+        metrics.ICON_SECONDS.observe(seconds, "ok" if error is None else "error")
+        if error is not None:
+            raise error
+        # The index ETag covers the icon directory
+        assets.invalidate_icons()
+        return filename
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
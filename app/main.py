@@ -1,17 +1,22 @@
 from fastapi import FastAPI, Request, Depends
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, RedirectResponse
 from starlette.middleware.sessions import SessionMiddleware
-from sqlalchemy.orm import Session
-import uvicorn
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
 import os
-from . import models, database, crud, deps, mappings, schemas
+from . import database, crud, deps, cache, migrations, icons, assets, metrics
 from .database import engine
-from .routers import auth, items, ai, subcategories
+from .routers import auth, items, ai, subcategories, bulk, events, sync
+from .routers import metrics as metrics_router
 
-# Create tables
-models.Base.metadata.create_all(bind=engine)
+logging.basicConfig(
+    level=os.getenv("WAREHOUSE_LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+# SQL statement counts/timings for /metrics and the slow-request log
+metrics.instrument_engines(database.engine, database.write_engine, database.async_engine, database.async_write_engine)
 
 app = FastAPI(title="Warehouse 21")
 
@@ -19,64 +24,126 @@ app = FastAPI(title="Warehouse 21")
 # https_only=False allows usage on localhost and HTTP over LAN
 app.add_middleware(SessionMiddleware, secret_key="secret-key-warehouse-21", https_only=False, same_site="lax")
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# Outermost: per-route latency and SQL usage, including session handling
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Mount static files (content ETags, immutable caching for versioned URLs, precompressed CSS)
+app.mount("/static", assets.CachedStaticFiles(directory="app/static"), name="static")
 
 # Templates
 templates = Jinja2Templates(directory="app/templates")
+templates.env.globals["asset_url"] = assets.asset_url
 
 # Include Routers
 app.include_router(auth.router)
 app.include_router(items.router)
 app.include_router(ai.router)
 app.include_router(subcategories.router)
+app.include_router(bulk.router)
+app.include_router(events.router)
+app.include_router(sync.router)
+app.include_router(metrics_router.router)
 
-# Initialize Categories
 @app.on_event("startup")
 def on_startup():
-    db = database.SessionLocal()
-    crud.init_categories(db)
-    db.close()
+    # Schema, indexes and default categories; one PRAGMA read when the database is current
+    migrations.upgrade(engine)
+    assets.precompress()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    icons.shutdown()
+
+# Per-user page: browsers may keep it but must revalidate (cheap 304 via the ETag)
+INDEX_CACHE_CONTROL = "private, no-cache"
 
 @app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request, db: Session = Depends(deps.get_db)):
+async def read_root(request: Request, db: AsyncSession = Depends(deps.get_async_db)):
     # Check if setup needed
-    if not db.query(models.User).filter(models.User.is_admin == True).first():
+    if not await crud.admin_exists_async(db):
         return RedirectResponse(url="/setup")
     
-    current_user = await deps.get_current_user(request, db)
-    items_orm = crud.get_items(db)
-    categories = db.query(models.Category).all()
-
-    # Serialize items for Jinja/JSON usage
-    # We use the Pydantic schema to convert specific fields and handle date serialization
-    from fastapi.encoders import jsonable_encoder
-    items_data = [jsonable_encoder(schemas.Item.from_orm(i)) for i in items_orm]
-    
-    # Build CAT_STRUCTURE dynamically from DB
-    cat_structure = {}
-    for cat in categories:
-        subs = {}
-        for sub in cat.subcategories:
-            subs[sub.slug] = {
-                "id": sub.id,  # Add ID for CRUD operations
-                "name": sub.name,
-                "icon": sub.icon_path
-            }
-        
-        cat_structure[cat.slug] = {
-            "name": cat.name,
-            "id": cat.id,
-            "subs": subs
-        }
-
-    return templates.TemplateResponse("index.html", {
+    current_user = await deps.get_current_user(request)
+
+    # The page depends on the taxonomy, the user and the static assets; items come from the API
+    user_key = f"{current_user.id}{'a' if current_user.is_admin else ''}" if current_user else "anon"
+    etag = f'"index-{await cache.data_version_async(db)}-{user_key}-{assets.fingerprint()}"'
+    if deps.etag_matches(request, etag):
+        return deps.not_modified(etag, INDEX_CACHE_CONTROL)
+
+    taxonomy = await cache.get_taxonomy_async(db)
+
+    # Items are no longer embedded: the page pulls them from GET /api/items/ page by page
+    response = templates.TemplateResponse("index.html", {
         "request": request, 
-        "items": items_data, 
-        "categories": categories,
+        "categories": taxonomy.categories,
         "user": current_user,
-        "cat_structure": cat_structure
+        "cat_structure": taxonomy.structure,
+        "icon_versions": assets.icon_versions(),
+        "sprite_icons": assets.sprite_icons()
     })
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = INDEX_CACHE_CONTROL
+    return response
+
+# Run in a fresh interpreter by --startup-time: import, then the startup handlers
+STARTUP_PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+asyncio.run(app.main.app.router.startup())
+ready = time.perf_counter()
+asyncio.run(app.main.app.router.shutdown())
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "ai_sdk_loaded": "google.generativeai" in sys.modules,
+}))
+"""
+
+
+def measure_startup(runs: int) -> dict:
+    """Cold-start timings over `runs` fresh worker processes, as a worker restart would pay them."""
+    import json
+    import statistics
+    import subprocess
+    import sys
+    import time
+
+    samples = []
+    for run in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE], check=True, capture_output=True, text=True
+        ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_ms"] = (time.perf_counter() - started) * 1000
+        samples.append(sample)
+        print(f"run {run + 1}: process {sample['process_ms']:7.1f} ms  import {sample['import_ms']:7.1f} ms  "
+              f"startup {sample['startup_ms']:6.1f} ms", file=sys.stderr)
+    return {
+        "runs": runs,
+        **{
+            f"{key}_median": round(statistics.median(s[key] for s in samples), 1)
+            for key in ("process_ms", "import_ms", "startup_ms")
+        },
+        "ai_sdk_loaded": any(s["ai_sdk_loaded"] for s in samples),
+        "schema_version": migrations.SCHEMA_VERSION,
+    }
+
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    import argparse
+    import json
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Warehouse 21 server")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="measure cold start (interpreter, import, startup handlers) and exit")
+    parser.add_argument("--runs", type=int, default=5, help="processes to start for --startup-time")
+    args = parser.parse_args()
+    if args.startup_time:
+        print(json.dumps(measure_startup(args.runs), indent=2))
+    else:
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -42,3 +42,23 @@ ICON_MAPPING = {
     "alcohol": "bottle_glass.png",
     "general": "pack_generic.png"
 }
+
+# Transliteration map for Russian -> Latin
+TRANSLIT_MAP = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+}
+
+def transliterate(text: str) -> str:
+    """Transliterate Russian text to Latin."""
+    result = []
+    for char in text.lower():
+        result.append(TRANSLIT_MAP.get(char, char))
+    return ''.join(result)
+
+def search_transliteration(text: str) -> str:
+    """Latin form of a name for search: ё is folded to е, as people type "tushenka" for "Тушёнка"."""
+    return transliterate(text.replace('ё', 'е').replace('Ё', 'Е'))
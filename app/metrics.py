@@ -0,0 +1,219 @@
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from sqlalchemy import event
+
+# In-process metrics, exposed in Prometheus text format on GET /metrics.
+# Values are per process; with several workers each one reports its own.
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this (ms) are logged with every SQL statement they issued; 0 disables
+SLOW_REQUEST_MS = float(os.getenv("WAREHOUSE_SLOW_REQUEST_MS", "0"))
+# Statements kept per request for the slow log
+SLOW_LOG_MAX_STATEMENTS = 200
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+# Statements per request: a jump in the upper buckets is an N+1
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+AI_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', le)])} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {counts[-1]:g}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+REQUEST_SECONDS = Histogram(
+    "warehouse_http_request_duration_seconds", "HTTP request latency by route.",
+    LATENCY_BUCKETS, ("method", "route", "status"))
+REQUEST_SQL_STATEMENTS = Histogram(
+    "warehouse_http_request_sql_statements", "SQL statements issued per HTTP request.",
+    SQL_COUNT_BUCKETS, ("method", "route"))
+REQUEST_SQL_SECONDS = Counter(
+    "warehouse_http_request_sql_seconds_total", "Time spent in SQL by route.", ("method", "route"))
+SQL_SECONDS = Histogram(
+    "warehouse_sql_statement_duration_seconds", "Latency of single SQL statements.", SQL_BUCKETS)
+ICON_SECONDS = Histogram(
+    "warehouse_icon_processing_seconds", "Pillow decode/resize/encode time per uploaded icon, measured in the worker.",
+    LATENCY_BUCKETS, ("outcome",))
+AI_SECONDS = Histogram(
+    "warehouse_ai_upstream_seconds", "Time for the AI provider to finish a reply.", AI_BUCKETS, ("outcome",))
+AI_FIRST_TOKEN_SECONDS = Histogram(
+    "warehouse_ai_first_token_seconds", "Time until the AI provider streams its first event.", AI_BUCKETS)
+AI_REJECTED = Counter("warehouse_ai_rejected_total", "AI requests turned away with 429.")
+AI_CACHE_HITS = Counter("warehouse_ai_cache_hits_total", "AI replies served from the response cache.")
+
+REGISTRY = [
+    REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS, SQL_SECONDS,
+    ICON_SECONDS, AI_SECONDS, AI_FIRST_TOKEN_SECONDS, AI_REJECTED, AI_CACHE_HITS,
+]
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# Per-request SQL accounting. Sync routes run in the thread pool with a copy of the
+# request's context, so they share the same RequestStats object.
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_seconds", "statements")
+
+    def __init__(self, collect_statements: bool):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = [] if collect_statements else None
+
+
+_current = contextvars.ContextVar("warehouse_request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    SQL_SECONDS.observe(elapsed)
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.sql_count += 1
+    stats.sql_seconds += elapsed
+    if stats.statements is not None and len(stats.statements) < SLOW_LOG_MAX_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't run for failed statements
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def instrument_engines(*engines):
+    """Count and time every statement on these engines (sync or async)."""
+    for engine in {getattr(e, "sync_engine", e) for e in engines}:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def _route_label(scope) -> str:
+    # Route templates, not raw paths, to keep label cardinality bounded
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope.get("path", "").startswith("/static/"):
+        return "/static"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Records latency and SQL usage per route; logs the SQL of slow requests if enabled."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(collect_statements=SLOW_REQUEST_MS > 0)
+        token = _current.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            method, route = scope["method"], _route_label(scope)
+            REQUEST_SECONDS.observe(elapsed, method, route, str(status))
+            REQUEST_SQL_STATEMENTS.observe(stats.sql_count, method, route)
+            REQUEST_SQL_SECONDS.inc(stats.sql_seconds, method, route)
+            if stats.statements is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+                _log_slow_request(method, scope.get("path", ""), route, status, elapsed, stats)
+
+
+def _log_slow_request(method, path, route, status, elapsed, stats):
+    lines = [
+        f"Slow request: {method} {path} ({route}) -> {status} in {elapsed * 1000:.1f} ms, "
+        f"{stats.sql_count} SQL statements in {stats.sql_seconds * 1000:.1f} ms"
+    ]
+    for seconds, statement in stats.statements:
+        lines.append(f"  [{seconds * 1000:.2f} ms] {' '.join(statement.split())}")
+    if stats.sql_count > len(stats.statements):
+        lines.append(f"  ... {stats.sql_count - len(stats.statements)} more")
+    logger.warning("\n".join(lines))
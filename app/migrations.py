@@ -0,0 +1,190 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+from . import models, mappings
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Tables whose rows are recorded in the change log, and their entity names there
+CHANGE_LOGGED = {"items": "item", "subcategories": "subcategory", "categories": "category"}
+
+
+def _change_triggers(table: str, entity: str):
+    # INSERT OR REPLACE drops the entity's previous row, so it gets a fresh, higher seq
+    record = "INSERT OR REPLACE INTO changes (entity, entity_id, op) VALUES ('{entity}', {ref}.id, '{op}');"
+    for event, ref, op in (("INSERT", "NEW", "upsert"), ("UPDATE", "NEW", "upsert"), ("DELETE", "OLD", "delete")):
+        body = record.format(entity=entity, ref=ref, op=op)
+        yield f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_change AFTER {event} ON {table} BEGIN {body} END"
+
+
+def _install_change_log(conn, seed: bool):
+    for table, entity in CHANGE_LOGGED.items():
+        for ddl in _change_triggers(table, entity):
+            conn.execute(text(ddl))
+        if seed:
+            # A fresh log starts with every existing row, so since=0 is a full snapshot
+            conn.execute(text(
+                f"INSERT INTO changes (entity, entity_id, op) SELECT '{entity}', id, 'upsert' FROM {table} ORDER BY id"
+            ))
+
+
+# Full-text index over item names and their Latin transliteration. The triggers only
+# copy stored columns (items.name_translit is computed in Python, see models.Item), so
+# any SQLite client can write items. prefix='2 3' keeps short prefix queries off the
+# full term scan.
+ITEMS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE items_fts USING fts5("
+    "name, name_translit, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+
+ITEMS_FTS_TRIGGERS = {
+    "trg_items_insert_fts": "AFTER INSERT ON items BEGIN "
+    "INSERT INTO items_fts (rowid, name, name_translit) VALUES (NEW.id, NEW.name, NEW.name_translit); END",
+    "trg_items_delete_fts": "AFTER DELETE ON items BEGIN "
+    "DELETE FROM items_fts WHERE rowid = OLD.id; END",
+    # Only renames touch the index; quantity updates don't
+    "trg_items_update_fts": "AFTER UPDATE OF name, name_translit ON items BEGIN "
+    "UPDATE items_fts SET name = NEW.name, name_translit = NEW.name_translit WHERE rowid = NEW.id; END",
+}
+
+
+def _install_items_fts(conn):
+    if not inspect(conn).has_table("items_fts"):
+        conn.execute(text(ITEMS_FTS_DDL))
+        conn.execute(text(
+            "INSERT INTO items_fts (rowid, name, name_translit) SELECT id, name, name_translit FROM items"
+        ))
+    for name, body in ITEMS_FTS_TRIGGERS.items():
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+
+
+def _migrate_item_subcategories(conn):
+    """Replace the copied `items.subcategory` slug and `items.icon_type` with a subcategory_id FK."""
+    columns = {c["name"] for c in inspect(conn).get_columns("items")}
+    if "subcategory" not in columns:
+        return
+    # The old (subcategory, name) index goes first; it is recreated on subcategory_id below
+    conn.execute(text("DROP INDEX IF EXISTS ix_items_subcategory_name"))
+    if "subcategory_id" not in columns:
+        conn.execute(text(
+            "ALTER TABLE items ADD COLUMN subcategory_id INTEGER REFERENCES subcategories (id) ON DELETE SET NULL"
+        ))
+    # Slugs nobody created a subcategory for (in the item's category) become subcategories,
+    # so no item loses its slug or icon
+    conn.execute(text(
+        "INSERT INTO subcategories (name, slug, icon_path, category_id) "
+        "SELECT subcategory, subcategory, MAX(icon_type), category_id FROM items "
+        "WHERE subcategory IS NOT NULL AND subcategory != '' "
+        "AND NOT EXISTS (SELECT 1 FROM subcategories s "
+        "WHERE s.slug = items.subcategory AND s.category_id IS items.category_id) "
+        "GROUP BY subcategory, category_id"
+    ))
+    # Slugs are only unique per category: match within the item's own category
+    conn.execute(text(
+        "UPDATE items SET subcategory_id = ("
+        "SELECT MIN(id) FROM subcategories s WHERE s.slug = items.subcategory AND s.category_id IS items.category_id"
+        ") WHERE subcategory IS NOT NULL AND subcategory != ''"
+    ))
+    conn.execute(text("ALTER TABLE items DROP COLUMN subcategory"))
+    conn.execute(text("ALTER TABLE items DROP COLUMN icon_type"))
+
+
+def _backfill_name_translit(conn):
+    # Rows from before the column existed; new rows get it from models.Item's default
+    rows = conn.execute(text("SELECT id, name FROM items WHERE name_translit IS NULL")).all()
+    if rows:
+        conn.execute(
+            text("UPDATE items SET name_translit = :name_translit WHERE id = :id"),
+            [{"id": row.id, "name_translit": mappings.search_transliteration(row.name or "")} for row in rows]
+        )
+
+
+def _add_missing_columns(conn, table):
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        # New columns must carry a server_default if they are NOT NULL
+        ddl = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def _baseline(conn):
+    """Schema version 1: every table, column, index and trigger of the models.
+
+    Also reconciles databases created before schema versions were recorded, so it
+    only adds what is missing. `create_all` only creates missing tables, so columns
+    and indexes added to existing tables later on are created here explicitly.
+    """
+    had_change_log = inspect(conn).has_table(models.Change.__tablename__)
+    models.Base.metadata.create_all(bind=conn)
+    # Data migrations run before the generic column/index pass below
+    _migrate_item_subcategories(conn)
+    for table in models.Base.metadata.sorted_tables:
+        _add_missing_columns(conn, table)
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+    _backfill_name_translit(conn)
+    _install_change_log(conn, seed=not had_change_log)
+    _install_items_fts(conn)
+
+
+def _seed_taxonomy(conn):
+    """Schema version 2: default categories and subcategories (used to run on every startup)."""
+    # Imported here: crud pulls in the caches, which the migration CLI doesn't need otherwise
+    from . import crud
+    with Session(bind=conn) as db:
+        crud.init_categories(db)
+
+
+# Ordered steps; the database records the last one applied in PRAGMA user_version.
+# Append new steps (never edit applied ones) and each database runs only what it lacks.
+MIGRATIONS = [
+    (1, _baseline),
+    (2, _seed_taxonomy),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def upgrade(engine: Engine) -> bool:
+    """Apply the migrations this database hasn't seen; returns False if it was current.
+
+    An up-to-date database costs one PRAGMA read. Each step runs in its own
+    BEGIN IMMEDIATE transaction, so workers starting together apply it once.
+    Triggers and user_version are SQLite; the app only targets SQLite.
+    """
+    with engine.connect() as conn:
+        # Transactions are issued by hand to get BEGIN IMMEDIATE
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if schema_version(conn) >= SCHEMA_VERSION:
+            return False
+        for version, step in MIGRATIONS:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                # Re-read under the write lock: another process may have just applied it
+                if schema_version(conn) < version:
+                    started = time.perf_counter()
+                    step(conn)
+                    conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+                    logger.info("Applied schema migration %d (%s) in %.0f ms",
+                                version, step.__name__, (time.perf_counter() - started) * 1000)
+                conn.exec_driver_sql("COMMIT")
+            except BaseException:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+    return True
+
+
+if __name__ == "__main__":
+    # Deploy step: python -m app.migrations
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    from .database import engine
+    applied = upgrade(engine)
+    print(f"schema version {SCHEMA_VERSION}" + ("" if applied else " (already current)"))
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Date
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Date, Index
 from sqlalchemy.orm import relationship
 from .database import Base
+from . import mappings
 
 class User(Base):
     __tablename__ = "users"
@@ -37,11 +38,60 @@ class Item(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
+    # Latin form of the name, indexed by items_fts; filled in Python on insert (and by
+    # crud.update_item on renames) so the FTS triggers only copy columns
+    name_translit = Column(
+        String, nullable=True,
+        default=lambda ctx: mappings.search_transliteration(ctx.get_current_parameters().get("name") or "")
+    )
     quantity = Column(Integer, default=0)
     target_quantity = Column(Integer, default=0)
-    icon_type = Column(String, default="pack_generic.png")
     expiry_date = Column(Date, nullable=True)
-    subcategory = Column(String, nullable=True)
+    # The item's slug and icon come from the subcategory (cache.Taxonomy), so renaming
+    # a subcategory or changing its icon never rewrites item rows
+    subcategory_id = Column(Integer, ForeignKey("subcategories.id", ondelete="SET NULL"), nullable=True)
     category_id = Column(Integer, ForeignKey("categories.id"))
+    # Row version for optimistic concurrency, bumped by every update
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     category = relationship("Category", back_populates="items")
+
+    # ORM flushes also check and bump the row version
+    __mapper_args__ = {"version_id_col": version}
+
+    # Composite indexes backing the filtered keyset listing (crud.get_items).
+    # SQLite appends the rowid (id) to every index, so (x, name) also orders by (x, name, id).
+    # (x) alone is (x, id): the sort=id pages of a category/subcategory filter (what the
+    # index page loads) walk it in order instead of sorting the whole category.
+    __table_args__ = (
+        Index("ix_items_category_name", "category_id", "name"),
+        Index("ix_items_category", "category_id"),
+        # Also serves the FK lookup when a subcategory is deleted
+        Index("ix_items_subcategory_name", "subcategory_id", "name"),
+        Index("ix_items_subcategory", "subcategory_id"),
+        Index("ix_items_expiry_date", "expiry_date"),
+        # Partial index: only rows below target, so shortfall scans stay tiny
+        Index("ix_items_shortfall", "id", sqlite_where=quantity < target_quantity),
+    )
+
+
+class Change(Base):
+    """Change log behind delta sync (GET /api/sync), written by triggers (see migrations).
+
+    One row per entity: every write replaces the entity's row under a new, higher seq,
+    so the log stays as large as the data and deletes remain as tombstones.
+    """
+    __tablename__ = "changes"
+
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)  # "item", "subcategory" or "category"
+    entity_id = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # "upsert" or "delete"
+
+    __table_args__ = (
+        Index("ux_changes_entity", "entity", "entity_id", unique=True),
+        # Newest change per entity type (cache.get_taxonomy checks categories/subcategories)
+        Index("ix_changes_entity_seq", "entity", "seq"),
+        # AUTOINCREMENT: seqs are never reused, even after the newest row is replaced
+        {"sqlite_autoincrement": True},
+    )
@@ -1,18 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-from .. import deps, crud, schemas, models
-import google.generativeai as genai
-import os
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from .. import deps, crud, schemas, cache, database, ai_provider, broadcast, metrics
+from typing import List
 import json
+import logging
+import time
 
 router = APIRouter(prefix="/api/ai", tags=["ai"])
-
-# Configure Gemini
-# NOTE: In production, ensure GEMINI_API_KEY is set in environment structure.
-# For this demo, we assume the user has set it or will set it.
-api_key = os.getenv("GEMINI_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
+logger = logging.getLogger(__name__)
 
 # System Prompt
 SYSTEM_PROMPT = """
@@ -24,95 +19,196 @@ You have access to the inventory database.
 When user asks to ADD items:
 1. Identify the item name and quantity.
 2. Map it to one of these categories: Food (food), Drinks (drinks), Misc (misc).
-3. Map it to an icon: 
-   - Food: can_meat.png, can_fish.png, jar.png, bowl.png, box.png
-   - Drinks: bottle_5l.png, bottle_2l.png, can_drink.png, bottle_glass.png
-   - Misc: pack_generic.png
-4. Call the `add_item` function.
+3. Call the `add_item` function once per item. A delivery with several items means several calls in one reply.
 
+Every message comes with a current INVENTORY summary.
 When user asks "What to cook?":
-1. Call `get_inventory` first.
+1. Use the INVENTORY summary; prefer items listed under USE FIRST.
 2. Suggest a "wasteland recipe" based on available items.
 """
 
 # Tool Definitions
-def add_item_tool(name: str, quantity: int, category_slug: str, icon_type: str):
+def add_item_tool(name: str, quantity: int, category_slug: str):
     """Add an item to the inventory."""
     # This is a stub for the model to see. Logic handles actual DB write.
-    return f"Added {quantity} x {name} ({category_slug}) icon: {icon_type}"
+    return f"Added {quantity} x {name} ({category_slug})"
+
+tools = [add_item_tool]
+
+API_KEY_MISSING = "SYSTEM ERROR: API_KEY_MISSING. CONTACT ADMIN."
+COMMUNICATION_FAILURE = "COMMUNICATION FAILURE. INTERFERENCE DETECTED."
+
+
+def _validate_additions(calls: List[dict], taxonomy: cache.Taxonomy):
+    """Turn add_item_tool calls into ItemCreate objects; returns (items, rejected descriptions)."""
+    items, rejected = [], []
+    for args in calls:
+        name = str(args.get('name') or "").strip()
+        try:
+            quantity = int(args.get('quantity'))
+        except (TypeError, ValueError):
+            quantity = None
+        if not name or quantity is None or quantity <= 0:
+            rejected.append(name or "?")
+            continue
+        # Unknown categories land in Misc, as before
+        cat_id = taxonomy.category_ids.get(args.get('category_slug')) or taxonomy.category_ids.get('misc')
+        items.append(schemas.ItemCreate(
+            name=name,
+            quantity=quantity,
+            target_quantity=10, # Default
+            category_id=cat_id
+        ))
+    return items, rejected
+
+
+async def _add_items(calls: List[dict]) -> str:
+    # A session only for the write, not for the whole (slow) model call
+    async with database.AsyncSessionLocal() as db:
+        taxonomy = await cache.get_taxonomy_async(db)
+        items, rejected = _validate_additions(calls, taxonomy)
+        if items:
+            db_items = await db.run_sync(crud.create_items, items, taxonomy)
+            for db_item in db_items:
+                broadcast.item_upserted(crud.item_dict(db_item, taxonomy))
+
+    parts = []
+    if items:
+        added = ", ".join(f"{item.quantity} {item.name}" for item in items)
+        parts.append(f"ACKNOWLEDGE. ADDED {added}. STOCK UPDATED.")
+    if rejected:
+        parts.append(f"REJECTED (BAD NAME/QUANTITY): {', '.join(rejected)}.")
+    return " ".join(parts)
+
+
+async def _inventory_context() -> str:
+    # Cached on the inventory version; the session only connects on a rebuild
+    async with database.AsyncSessionLocal() as db:
+        return await cache.get_inventory_summary_async(db)
+
+
+async def _chat_events(provider: ai_provider.Provider, user_message: str, cache_key=None):
+    """Yield the reply text piece by piece; tool calls run together once the reply is complete.
+
+    Replies that wrote nothing are stored under `cache_key`.
+    """
+    try:
+        # Inventory goes along with every message, so recipes need a single model call
+        context = f"INVENTORY:\n{await _inventory_context()}"
+        additions, parts = [], []
+        start, first = time.perf_counter(), True
+        outcome = "error"
+        try:
+            async for event in provider.stream(user_message, context):
+                if first:
+                    metrics.AI_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                    first = False
+                if event.function_call == "add_item_tool":
+                    additions.append(event.args)
+                elif event.text:
+                    parts.append(event.text)
+                    yield event.text
+            outcome = "ok"
+        finally:
+            metrics.AI_SECONDS.observe(time.perf_counter() - start, outcome)
+        # A whole dictated delivery becomes one transaction and one confirmation
+        if additions:
+            yield await _add_items(additions)
+        elif cache_key is not None:
+            cache.put_ai_response(cache_key, "".join(parts))
+    except Exception as e:
+        logger.exception("AI request failed: %s", e)
+        yield COMMUNICATION_FAILURE
 
-def get_inventory_tool():
-    """Get current inventory list."""
-    return "Inventory list"
 
-tools = [add_item_tool, get_inventory_tool]
+def _sse(payload: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _admit():
+    """Take an upstream slot or fail fast with 429."""
+    try:
+        await ai_provider.admission.acquire()
+    except ai_provider.Overloaded:
+        metrics.AI_REJECTED.inc()
+        raise HTTPException(status_code=429, detail="AI BUSY. TRY AGAIN SHORTLY.", headers={"Retry-After": "5"})
+
 
 @router.post("/chat")
-async def chat(request: Request, data: dict, db: Session = Depends(deps.get_db), user: models.User = Depends(deps.require_admin)):
-    if not api_key:
-        return {"response": "SYSTEM ERROR: API_KEY_MISSING. CONTACT ADMIN."}
-    
-    user_message = data.get("message")
-    history = data.get("history", [])
+async def chat(data: dict, user: schemas.User = Depends(deps.require_admin)):
+    provider = ai_provider.get_provider(SYSTEM_PROMPT, tools)
+    if provider is None:
+        return {"response": API_KEY_MISSING}
 
+    user_message = data.get("message", "")
+    cache_key = cache.ai_response_key(user_message)
+    cached = cache.get_ai_response(cache_key)
+    if cached is not None:
+        metrics.AI_CACHE_HITS.inc()
+        return {"response": cached}
+
+    await _admit()
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash', tools=tools, system_instruction=SYSTEM_PROMPT)
-        chat = model.start_chat(enable_automatic_function_calling=True)
-        
-        # In a real app, we'd rebuild history here. For simplicity, we send neutral context + message
-        # But we need to handle function calls manually if we want to write to OUR DB.
-        # However, Gemini Python SDK `enable_automatic_function_calling` executes the python functions if they are passed.
-        # So we need to wrap our DB calls in the tool functions and pass 'db' context which is tricky with this SDK pattern in a stateless request.
-        # ALTERNATIVE: Use manual function calling.
-        
-        # Let's use a simpler approach for this prototype: Manual Tool handling
-        model_manual = genai.GenerativeModel('gemini-1.5-flash', tools=tools, system_instruction=SYSTEM_PROMPT)
-        chat_manual = model_manual.start_chat()
-        
-        response = chat_manual.send_message(user_message)
-        
-        part = response.parts[0]
-        
-        # Handle Function Call
-        if part.function_call:
-            fc = part.function_call
-            fname = fc.name
-            args = fc.args
-            
-            if fname == "add_item_tool":
-                # Find category
-                cat = db.query(models.Category).filter(models.Category.slug == args['category_slug']).first()
-                if not cat:
-                    cat = db.query(models.Category).filter(models.Category.slug == 'misc').first()
-                
-                # Create Item
-                item_in = schemas.ItemCreate(
-                    name=args['name'],
-                    quantity=int(args['quantity']),
-                    target_quantity=10, # Default
-                    icon_type=args['icon_type'],
-                    category_id=cat.id
-                )
-                crud.create_item(db, item_in)
-                
-                # Response back to model
-                # We simply return a confirmation message to the user for now
-                return {"response": f"ACKNOWLEDGE. ADDED {args['quantity']} {args['name']}. STOCK UPDATED."}
-                
-            elif fname == "get_inventory_tool":
-                items = crud.get_items(db)
-                inventory_str = ", ".join([f"{i.name} ({i.quantity})" for i in items])
-                
-                # Send result back to model to generate recipe
-                # We need to send the function response back.
-                # Since we are not maintaining stateful chat object across requests easily here without history reconstruction:
-                # We will just do a new generation with the inventory context.
-                
-                final_response = model_manual.generate_content(f"User asked: {user_message}. Inventory: {inventory_str}. Suggest a recipe.")
-                return {"response": final_response.text}
-
-        return {"response": response.text}
+        parts = [text async for text in _chat_events(provider, user_message, cache_key)]
+    finally:
+        ai_provider.admission.release()
+    return {"response": "".join(parts)}
 
-    except Exception as e:
-        print(f"AI Error: {e}")
-        return {"response": "COMMUNICATION FAILURE. INTERFERENCE DETECTED."}
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """Closes its generator when the response ends, however it ends.
+
+    A stream aborted by an exception otherwise leaves the generator (and its `finally`)
+    to the garbage collector, which may get to it much later.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+
+@router.post("/chat/stream")
+async def chat_stream(data: dict, user: schemas.User = Depends(deps.require_admin)):
+    """Same as /chat, as Server-Sent Events: `data: {"text": ...}` chunks, then `event: done`."""
+    provider = ai_provider.get_provider(SYSTEM_PROMPT, tools)
+    user_message = data.get("message", "")
+    cache_key = cache.ai_response_key(user_message)
+    cached = cache.get_ai_response(cache_key) if provider is not None else None
+    admitted = provider is not None and cached is None
+    if cached is not None:
+        metrics.AI_CACHE_HITS.inc()
+    if admitted:
+        # Before the response starts, so an overloaded server still answers with a status code
+        await _admit()
+
+    released = False
+
+    def release():
+        nonlocal released
+        if admitted and not released:
+            released = True
+            ai_provider.admission.release()
+
+    async def events():
+        # Released here, not in a BackgroundTask: Starlette skips background tasks when
+        # the stream ends with an exception (e.g. the client disconnecting)
+        try:
+            if provider is None:
+                yield _sse({"text": API_KEY_MISSING})
+            elif cached is not None:
+                yield _sse({"text": cached})
+            else:
+                async for text in _chat_events(provider, user_message, cache_key):
+                    yield _sse({"text": text})
+            yield _sse({}, event="done")
+        finally:
+            release()
+
+    return _ClosingStreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -2,16 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException, status, Request, Form
 from fastapi.responses import RedirectResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
-from .. import crud, schemas, deps, models
+from .. import crud, schemas, deps, models, assets
 import hashlib
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
+templates.env.globals["asset_url"] = assets.asset_url
 
 @router.get("/setup", response_class=HTMLResponse)
 def setup_page(request: Request, db: Session = Depends(deps.get_db)):
     # Check if admin exists
-    if db.query(models.User).filter(models.User.is_admin == True).first():
+    if crud.admin_exists(db):
         return RedirectResponse(url="/", status_code=303)
     return templates.TemplateResponse("setup.html", {"request": request})
 
@@ -22,7 +23,7 @@ def setup_admin(
     password: str = Form(...),
     db: Session = Depends(deps.get_db)
 ):
-    if db.query(models.User).filter(models.User.is_admin == True).first():
+    if crud.admin_exists(db):
         return RedirectResponse(url="/", status_code=303)
     
     user_in = schemas.UserCreate(username=username, password=password)
@@ -0,0 +1,170 @@
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from typing import Optional
+from .. import crud, schemas, deps, models, database, cache, broadcast
+import csv
+import io
+import json
+
+router = APIRouter(prefix="/api/items", tags=["items"])
+
+# Rows per executemany/commit when importing, rows per fetch when exporting
+CHUNK_SIZE = 1000
+# Stop collecting error details past this many (the count keeps going)
+MAX_REPORTED_ERRORS = 100
+
+EXPORT_COLUMNS = [
+    "id", "name", "quantity", "target_quantity", "icon_type",
+    "subcategory", "subcategory_id", "expiry_date", "category_id",
+]
+
+
+def _detect_format(file: UploadFile, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    filename = (file.filename or "").lower()
+    content_type = (file.content_type or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    return "csv"
+
+
+def _iter_rows(text_stream, fmt: str):
+    """Yield (line_number, raw_dict_or_error) without loading the whole upload."""
+    if fmt == "csv":
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+                continue
+            if not isinstance(row, dict):
+                yield line_number, ValueError("Expected a JSON object")
+                continue
+            yield line_number, row
+
+
+def _to_item_row(raw: dict, taxonomy: cache.Taxonomy) -> dict:
+    # CSV cells arrive as strings; treat empty cells as "not provided"
+    data = {k: v for k, v in raw.items() if k and v not in ("", None)}
+
+    # Allow a category slug instead of a numeric id
+    category_slug = data.pop("category", None)
+    if "category_id" not in data and category_slug is not None:
+        if category_slug not in taxonomy.category_ids:
+            raise ValueError(f"Unknown category '{category_slug}'")
+        data["category_id"] = taxonomy.category_ids[category_slug]
+
+    return crud.item_values(schemas.ItemCreate(**data), taxonomy)
+
+
+@router.post("/bulk")
+def bulk_import_items(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    db: Session = Depends(deps.get_db),
+    current_user: schemas.User = Depends(deps.require_admin)
+):
+    """Import items from a CSV or NDJSON upload in chunked transactions.
+
+    Valid rows are inserted; invalid rows are skipped and reported by line number.
+    """
+    fmt = _detect_format(file, format)
+    taxonomy = cache.get_taxonomy(db)
+
+    # The upload is spooled to disk by the multipart parser; read it as a text stream
+    text_stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+
+    inserted = 0
+    error_count = 0
+    errors = []
+    chunk = []
+
+    try:
+        for line_number, raw in _iter_rows(text_stream, fmt):
+            try:
+                if isinstance(raw, Exception):
+                    raise raw
+                chunk.append(_to_item_row(raw, taxonomy))
+            except ValidationError as e:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    message = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                    errors.append({"line": line_number, "error": message})
+                continue
+            except (ValueError, TypeError) as e:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"line": line_number, "error": str(e)})
+                continue
+
+            if len(chunk) >= CHUNK_SIZE:
+                inserted += crud.bulk_insert_items(db, chunk)
+                chunk = []
+        inserted += crud.bulk_insert_items(db, chunk)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable upload: {e}")
+    finally:
+        text_stream.detach()
+        # Earlier chunks are committed even if a later one fails
+        if inserted:
+            broadcast.items_reload()
+
+    return {"inserted": inserted, "error_count": error_count, "errors": errors}
+
+
+def _export_rows(fmt: str):
+    # Own session: the request-scoped one is closed before the body is streamed
+    db = database.SessionLocal()
+    try:
+        # Slug and icon are joined in from the item's subcategory
+        derived = {
+            "subcategory": models.SubCategory.slug.label("subcategory"),
+            "icon_type": func.coalesce(models.SubCategory.icon_path, cache.DEFAULT_ICON).label("icon_type"),
+        }
+        columns = [derived[c] if c in derived else getattr(models.Item, c) for c in EXPORT_COLUMNS]
+        result = db.execute(
+            select(*columns)
+            .outerjoin(models.SubCategory, models.Item.subcategory_id == models.SubCategory.id)
+            .order_by(models.Item.id)
+            .execution_options(yield_per=CHUNK_SIZE)
+        )
+
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+
+        for partition in result.partitions():
+            buffer = io.StringIO()
+            if fmt == "csv":
+                writer = csv.writer(buffer)
+                writer.writerows(partition)
+            else:
+                for row in partition:
+                    buffer.write(json.dumps(dict(row._mapping), default=str, ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+@router.get("/export")
+def export_items(format: str = Query("csv", pattern="^(csv|ndjson)$")):
+    """Stream the whole inventory as CSV or NDJSON without materializing it."""
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_rows(format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="items.{format}"'}
+    )
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+from .. import broadcast
+import asyncio
+
+router = APIRouter(prefix="/api", tags=["events"])
+
+# Comment line sent on idle connections so proxies don't time them out
+KEEPALIVE_SECONDS = 15
+
+
+@router.get("/events")
+async def events(request: Request):
+    """Server-Sent Events feed of inventory changes (see app/broadcast.py for event shapes)."""
+    subscriber = broadcast.subscribe()
+
+    async def stream():
+        try:
+            # Tells the client the feed is live, so it can refetch anything it missed while away
+            yield b"event: ready\ndata: {}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"data: " + broadcast.encode(event) + b"\n\n"
+        finally:
+            broadcast.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,34 +1,182 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
-from typing import List
-from .. import crud, schemas, deps, models
+from typing import List, Optional
+from datetime import date
+from .. import crud, schemas, deps, models, cache, broadcast
+import base64
+import json
 
 router = APIRouter(prefix="/api/items", tags=["items"])
 
-@router.get("/", response_model=List[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(deps.get_db)):
-    items = crud.get_items(db, skip=skip, limit=limit)
-    return items
+# Key element types per sort order, as written by _encode_cursor: (name, id) or (id,)
+CURSOR_KEY_TYPES = {"id": (int,), "name": (str, int)}
+
+def _encode_cursor(item: models.Item, sort: str) -> str:
+    key = [item.name, item.id] if sort == "name" else [item.id]
+    raw = json.dumps({"s": sort, "k": key}, ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def _decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        key = tuple(data["k"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if data.get("s") != sort:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    types = CURSOR_KEY_TYPES[sort]
+    # bool is an int subclass, but never a valid key
+    if len(key) != len(types) or not all(
+        isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(key, types)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+CATEGORY_FIELDS = list(schemas.CategoryRef.model_fields)
+
+def _item_dict(item: models.Item, taxonomy: cache.Taxonomy, expand_category: bool = False) -> dict:
+    # Serialized straight from ORM attributes: skipping per-item pydantic
+    # validation is most of the CPU saved on large pages
+    data = crud.item_dict(item, taxonomy)
+    if expand_category:
+        category = item.category
+        data["category"] = {field: getattr(category, field) for field in CATEGORY_FIELDS} if category else None
+    return data
+
+# Repeat polls revalidate and get 304 until an item or the taxonomy changes
+ITEMS_CACHE_CONTROL = "no-cache"
+
+@router.get("/", response_model=schemas.ItemPage, response_class=ORJSONResponse)
+def read_items(
+    request: Request,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    sort: str = Query("id", pattern="^(id|name)$"),
+    category_id: Optional[int] = None,
+    subcategory: Optional[str] = None,
+    subcategory_id: Optional[int] = None,
+    low_stock: bool = False,
+    expires_from: Optional[date] = None,
+    expires_to: Optional[date] = None,
+    name_prefix: Optional[str] = None,
+    expand: Optional[str] = Query(None, pattern="^category$"),
+    db: Session = Depends(deps.get_db)
+):
+    # Version taken before querying: a write racing the query only makes the ETag conservative
+    etag = f'"items-{cache.data_version(db)}"'
+    if deps.etag_matches(request, etag):
+        return deps.not_modified(etag, ITEMS_CACHE_CONTROL)
+
+    expand_category = expand == "category"
+    after = _decode_cursor(cursor, sort) if cursor else None
+    # Fetch one extra row to know whether there is a next page
+    items = crud.get_items(
+        db,
+        limit=limit + 1,
+        after=after,
+        sort=sort,
+        category_id=category_id,
+        subcategory=subcategory,
+        subcategory_id=subcategory_id,
+        low_stock=low_stock,
+        expires_from=expires_from,
+        expires_to=expires_to,
+        name_prefix=name_prefix,
+        with_category=expand_category,
+    )
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = _encode_cursor(items[-1], sort)
+    taxonomy = cache.get_taxonomy(db)
+    return ORJSONResponse({
+        "items": [_item_dict(i, taxonomy, expand_category) for i in items],
+        "next_cursor": next_cursor
+    }, headers={"ETag": etag, "Cache-Control": ITEMS_CACHE_CONTROL})
+
+@router.get("/expiring", response_model=List[schemas.Item], response_class=ORJSONResponse)
+def read_expiring_items(days: int = Query(7, ge=0, le=3650), limit: int = Query(100, ge=1, le=500), db: Session = Depends(deps.get_db)):
+    items = crud.get_expiring_items(db, days=days, limit=limit)
+    taxonomy = cache.get_taxonomy(db)
+    return ORJSONResponse([_item_dict(i, taxonomy) for i in items])
+
+@router.get("/shortfall", response_model=List[schemas.Item], response_class=ORJSONResponse)
+def read_shortfall_items(limit: int = Query(100, ge=1, le=500), db: Session = Depends(deps.get_db)):
+    items = crud.get_shortfall_items(db, limit=limit)
+    taxonomy = cache.get_taxonomy(db)
+    return ORJSONResponse([_item_dict(i, taxonomy) for i in items])
+
+@router.get("/search", response_model=List[schemas.Item], response_class=ORJSONResponse)
+def search_items(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=100), db: Session = Depends(deps.get_db)):
+    """Prefix search over item names; Latin input also finds Cyrillic names ("tushenka" -> "Тушёнка")."""
+    items = crud.search_items(db, q, limit=limit)
+    taxonomy = cache.get_taxonomy(db)
+    return ORJSONResponse([_item_dict(i, taxonomy) for i in items])
+
+@router.get("/watchlist", response_model=schemas.Watchlist)
+def read_watchlist(db: Session = Depends(deps.get_db)):
+    return cache.get_watchlist(db)
 
 @router.post("/", response_model=schemas.Item)
-def create_item(item: schemas.ItemCreate, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.require_admin)):
-    return crud.create_item(db=db, item=item)
+def create_item(item: schemas.ItemCreate, db: Session = Depends(deps.get_db), current_user: schemas.User = Depends(deps.require_admin)):
+    try:
+        db_item = crud.create_item(db=db, item=item)
+    except crud.UnknownSubcategory as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    data = _item_dict(db_item, cache.get_taxonomy(db))
+    broadcast.item_upserted(data)
+    return data
+
+@router.patch("/{item_id}", response_model=schemas.Item)
+def patch_item(item_id: int, changes: schemas.ItemUpdate, db: Session = Depends(deps.get_db), current_user: schemas.User = Depends(deps.require_admin)):
+    try:
+        db_item = crud.update_item(db, item_id, changes)
+    except crud.VersionConflict as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Item was modified by someone else", "version": e.current_version}
+        )
+    except crud.UnknownSubcategory as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not db_item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    data = _item_dict(db_item, cache.get_taxonomy(db))
+    broadcast.item_upserted(data)
+    return data
+
+@router.post("/adjust", response_model=List[schemas.Item])
+def adjust_items(adjustments: List[schemas.StockAdjustment], db: Session = Depends(deps.get_db), current_user: schemas.User = Depends(deps.require_admin)):
+    items, missing = crud.adjust_item_quantities(db, adjustments)
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "Items not found", "ids": missing})
+    taxonomy = cache.get_taxonomy(db)
+    data = [_item_dict(item, taxonomy) for item in items]
+    for item in data:
+        broadcast.item_upserted(item)
+    return data
+
+@router.post("/{item_id}/adjust", response_model=schemas.Item)
+def adjust_item(item_id: int, adjustment: schemas.StockAdjust, db: Session = Depends(deps.get_db), current_user: schemas.User = Depends(deps.require_admin)):
+    db_item = crud.adjust_item_quantity(db, item_id, adjustment.delta)
+    if not db_item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    data = _item_dict(db_item, cache.get_taxonomy(db))
+    broadcast.item_upserted(data)
+    return data
 
 @router.put("/{item_id}", response_model=schemas.Item)
-def update_item_quantity(item_id: int, quantity: int, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.require_admin)):
-    db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
+def update_item_quantity(item_id: int, quantity: int, db: Session = Depends(deps.get_db), current_user: schemas.User = Depends(deps.require_admin)):
+    db_item = crud.set_item_quantity(db, item_id, quantity)
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
-    db_item.quantity = quantity
-    db.commit()
-    db.refresh(db_item)
-    return db_item
+    data = _item_dict(db_item, cache.get_taxonomy(db))
+    broadcast.item_upserted(data)
+    return data
 
 @router.delete("/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_item(item_id: int, db: Session = Depends(deps.get_db), current_user: models.User = Depends(deps.require_admin)):
-    db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
-    if not db_item:
+def delete_item(item_id: int, db: Session = Depends(deps.get_db), current_user: schemas.User = Depends(deps.require_admin)):
+    if not crud.delete_item(db, item_id):
         raise HTTPException(status_code=404, detail="Item not found")
-    db.delete(db_item)
-    db.commit()
+    broadcast.item_deleted(item_id)
     return None
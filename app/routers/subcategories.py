@@ -1,31 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
-from .. import crud, schemas, deps, models
-from PIL import Image
-import io
-import uuid
-import os
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, deps, models, cache, icons, broadcast
+from ..mappings import transliterate
+import logging
 import re
 
 router = APIRouter(prefix="/api/subcategories", tags=["subcategories"])
-
-UPLOAD_DIR = "app/static/icons"
-
-# Transliteration map for Russian -> Latin
-TRANSLIT_MAP = {
-    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
-    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
-    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
-    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
-    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
-}
-
-def transliterate(text: str) -> str:
-    """Transliterate Russian text to Latin."""
-    result = []
-    for char in text.lower():
-        result.append(TRANSLIT_MAP.get(char, char))
-    return ''.join(result)
+logger = logging.getLogger(__name__)
 
 def make_slug(name: str) -> str:
     """Create URL-safe slug from name with transliteration."""
@@ -37,44 +20,23 @@ def make_slug(name: str) -> str:
     slug = slug.strip('_')
     return slug
 
-def compress_image(image_bytes: bytes) -> str:
-    """Compress and resize image, save to static/icons, return filename."""
-    try:
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to RGB (in case of RGBA/P)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            
-        # Resize to max 256x256 (maintaining aspect ratio? Or square? Plan said 256x256 max)
-        img.thumbnail((256, 256))
-        
-        filename = f"{uuid.uuid4()}.png"
-        filepath = os.path.join(UPLOAD_DIR, filename)
-        
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        img.save(filepath, "PNG", optimize=True)
-        return filename
-    except Exception as e:
-        print(f"Image Error: {e}")
-        return "pack_generic.png" # Fallback
-
 @router.post("/", response_model=schemas.SubCategory)
 async def create_subcategory(
     name: str = Form(...),
     category_id: int = Form(...),
     file: UploadFile = File(default=None),
-    db: Session = Depends(deps.get_db),
-    current_user: models.User = Depends(deps.require_admin)
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: schemas.User = Depends(deps.require_admin)
 ):
     # Generate slug with transliteration
     slug = make_slug(name)
     
     # Check if exists in this category
-    existing = db.query(models.SubCategory).filter(
+    result = await db.execute(select(models.SubCategory).where(
         models.SubCategory.slug == slug, 
         models.SubCategory.category_id == category_id
-    ).first()
+    ))
+    existing = result.scalars().first()
     
     if existing:
         raise HTTPException(status_code=400, detail="Subcategory already exists in this category")
@@ -82,7 +44,10 @@ async def create_subcategory(
     icon_path = "pack_generic.png"
     if file:
         content = await file.read()
-        icon_path = compress_image(content)
+        try:
+            icon_path = await icons.process_icon_async(content)
+        except Exception as e:
+            logger.warning("Icon processing failed, using the generic icon: %s", e)
         
     sub_in = schemas.SubCategoryCreate(
         name=name,
@@ -94,8 +59,10 @@ async def create_subcategory(
     # Save to database
     db_sub = models.SubCategory(name=sub_in.name, slug=sub_in.slug, category_id=sub_in.category_id, icon_path=sub_in.icon_path)
     db.add(db_sub)
-    db.commit()
-    db.refresh(db_sub)
+    await db.commit()
+    await db.refresh(db_sub)
+    cache.invalidate_taxonomy()
+    broadcast.taxonomy_changed((await cache.get_taxonomy_async(db)).structure)
     return db_sub
 
 @router.put("/{subcategory_id}", response_model=schemas.SubCategory)
@@ -103,70 +70,49 @@ async def update_subcategory(
     subcategory_id: int,
     name: str = Form(...),
     file: UploadFile = File(None),
-    db: Session = Depends(deps.get_db),
-    current_user: models.User = Depends(deps.require_admin)
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: schemas.User = Depends(deps.require_admin)
 ):
-    """Update subcategory name and/or icon. Icon changes propagate to all items in this subcategory."""
-    # Get existing subcategory
-    subcategory = db.query(models.SubCategory).filter(
-        models.SubCategory.id == subcategory_id
-    ).first()
+    """Update subcategory name and/or icon.
+
+    Items reference the subcategory by id and take its slug and icon from it,
+    so this writes the subcategory row only, however many items it holds.
+    """
+    subcategory = await db.get(models.SubCategory, subcategory_id)
     
     if not subcategory:
         raise HTTPException(status_code=404, detail="Subcategory not found")
     
-    # Store old slug for item updates
-    old_slug = subcategory.slug
-    
     # Update name and regenerate slug with transliteration
     subcategory.name = name
-    new_slug = make_slug(name)
-    subcategory.slug = new_slug
+    subcategory.slug = make_slug(name)
     
     # Update icon if provided
-    icon_updated = False
     if file and file.filename:
-        # Compress and save new icon
+        # Process off the event loop; content-hashed name dedups identical uploads
         try:
-            # Ensure UPLOAD_DIR exists
-            os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-            img = Image.open(file.file)
-            img = img.convert("RGBA")
-            img.thumbnail((128, 128), Image.Resampling.LANCZOS)
-            
-            icon_filename = f"sub_{new_slug}.png"
-            filepath = os.path.join(UPLOAD_DIR, icon_filename)
-            img.save(filepath, "PNG", optimize=True)
-            
-            subcategory.icon_path = icon_filename
-            icon_updated = True
+            content = await file.read()
+            subcategory.icon_path = await icons.process_icon_async(content)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Failed to process icon: {str(e)}")
     
-    # Update all items with this subcategory (both slug and icon if changed)
-    items = db.query(models.Item).filter(
-        models.Item.subcategory == old_slug
-    ).all()
-    
-    for item in items:
-        # Update subcategory reference
-        item.subcategory = new_slug
-        # Update icon if it was changed
-        if icon_updated:
-            item.icon_type = subcategory.icon_path
-    
-    db.commit()
-    db.refresh(subcategory)
+    await db.commit()
+    await db.refresh(subcategory)
+    cache.invalidate_taxonomy()
+    # The AI summary names subcategories
+    cache.invalidate_inventory()
+    broadcast.taxonomy_changed((await cache.get_taxonomy_async(db)).structure)
+    # Open lists show the old slug/icon on their items
+    broadcast.items_reload()
     return subcategory
 
 @router.delete("/{subcategory_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_subcategory(
     subcategory_id: int,
     db: Session = Depends(deps.get_db),
-    current_user: models.User = Depends(deps.require_admin)
+    current_user: schemas.User = Depends(deps.require_admin)
 ):
-    """Delete a subcategory. Items in this subcategory will need manual reassignment."""
+    """Delete a subcategory. Its items are kept, without a subcategory."""
     subcategory = db.query(models.SubCategory).filter(
         models.SubCategory.id == subcategory_id
     ).first()
@@ -174,7 +120,18 @@ def delete_subcategory(
     if not subcategory:
         raise HTTPException(status_code=404, detail="Subcategory not found")
     
-    # Delete the subcategory
+    # Detach its items in the same transaction rather than leave dangling ids
+    # (SQLite only enforces ON DELETE SET NULL with PRAGMA foreign_keys on)
+    detached = db.execute(
+        update(models.Item)
+        .where(models.Item.subcategory_id == subcategory_id)
+        .values(subcategory_id=None, version=models.Item.version + 1)
+    ).rowcount
     db.delete(subcategory)
     db.commit()
+    cache.invalidate_taxonomy()
+    broadcast.taxonomy_changed(cache.get_taxonomy(db).structure)
+    if detached:
+        cache.invalidate_inventory()
+        broadcast.items_reload()
     return None
@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from .. import schemas, deps, models, crud, cache
+
+router = APIRouter(prefix="/api", tags=["sync"])
+
+# entity name in the change log -> (model, response key, serialized fields)
+ENTITIES = {
+    # Items go through crud.item_dict: slug and icon are the subcategory's
+    "item": (models.Item, "items", None),
+    "subcategory": (models.SubCategory, "subcategories", list(schemas.SubCategory.model_fields)),
+    "category": (models.Category, "categories", list(schemas.CategoryRef.model_fields)),
+}
+
+
+@router.get("/sync", response_model=schemas.SyncPage, response_class=ORJSONResponse)
+def sync(
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(deps.get_db)
+):
+    """Everything that changed after change number `since`, in O(changes).
+
+    Start with since=0 (full snapshot), then pass the returned `seq` next time;
+    repeat immediately while `has_more` is true. Deleted rows come back as ids in `deleted`.
+    """
+    # Writes are serialized, so seqs become visible in order and `seq` is a safe resume point
+    changes = db.execute(
+        select(models.Change.seq, models.Change.entity, models.Change.entity_id, models.Change.op)
+        .where(models.Change.seq > since)
+        .order_by(models.Change.seq)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    if changes:
+        seq = changes[-1].seq
+    else:
+        # Nothing new: echo the head so idle clients keep a current position
+        seq = max(since, db.scalar(select(func.max(models.Change.seq))) or 0)
+
+    upserted = {entity: [] for entity in ENTITIES}
+    deleted = {key: [] for _, key, _ in ENTITIES.values()}
+    for change in changes:
+        if change.entity not in ENTITIES:
+            continue
+        if change.op == "delete":
+            deleted[ENTITIES[change.entity][1]].append(change.entity_id)
+        else:
+            upserted[change.entity].append(change.entity_id)
+
+    page = {"since": since, "seq": seq, "has_more": has_more, "deleted": deleted}
+    for entity, ids in upserted.items():
+        model, key, fields = ENTITIES[entity]
+        rows = db.query(model).filter(model.id.in_(ids)).order_by(model.id).all() if ids else []
+        # A row deleted since the log was read has a later tombstone; the next sync brings it
+        if model is models.Item:
+            # A rename or icon change only logs the subcategory; clients join on subcategory_id
+            taxonomy = cache.get_taxonomy(db)
+            page[key] = [crud.item_dict(row, taxonomy) for row in rows]
+        else:
+            page[key] = [{field: getattr(row, field) for field in fields} for row in rows]
+    return ORJSONResponse(page)
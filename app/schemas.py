@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Optional, List
 
 # User Schemas
@@ -50,7 +50,8 @@ class ItemBase(BaseModel):
     name: str
     quantity: int = 0
     target_quantity: int = 0
-    icon_type: str = "pack_generic.png"
+    # Either one; a slug is resolved within the item's category
+    subcategory_id: Optional[int] = None
     subcategory: Optional[str] = None
     expiry_date: Optional[date] = None
     category_id: int
@@ -58,12 +59,75 @@ class ItemBase(BaseModel):
 class ItemCreate(ItemBase):
     pass
 
-class ItemUpdate(ItemBase):
-    pass
+class ItemUpdate(BaseModel):
+    # Partial update: only the fields that are sent get written
+    name: Optional[str] = None
+    quantity: Optional[int] = None
+    target_quantity: Optional[int] = None
+    subcategory_id: Optional[int] = None
+    subcategory: Optional[str] = None
+    expiry_date: Optional[date] = None
+    category_id: Optional[int] = None
+    # Expected row version; the update is rejected if the row has moved on
+    version: Optional[int] = None
+
+    @field_validator("name", "quantity", "target_quantity", "category_id")
+    @classmethod
+    def not_null(cls, value):
+        # Omit a field to keep it; only expiry_date and the subcategory can be cleared
+        if value is None:
+            raise ValueError("may be omitted, but not null")
+        return value
 
 class Item(ItemBase):
+    # Flat on purpose: nesting the category (and its subcategories) per item
+    # made every list response N+1 queries and mostly repeated payload
+    id: int
+    # The subcategory's icon
+    icon_type: str = "pack_generic.png"
+    version: int = 1
+
+    class Config:
+        from_attributes = True
+
+class CategoryRef(CategoryBase):
     id: int
-    category: Optional[Category] = None
 
     class Config:
         from_attributes = True
+
+class ItemExpanded(Item):
+    category: Optional[CategoryRef] = None
+
+class StockAdjust(BaseModel):
+    # Signed change in quantity; the result never drops below zero
+    delta: int
+
+class StockAdjustment(StockAdjust):
+    id: int
+
+class Watchlist(BaseModel):
+    expiring: int
+    shortfall: int
+    days: int
+    as_of: date
+
+class ItemPage(BaseModel):
+    # Items are ItemExpanded when requested with ?expand=category
+    items: List[Item]
+    next_cursor: Optional[str] = None
+
+class SyncDeleted(BaseModel):
+    items: List[int] = []
+    subcategories: List[int] = []
+    categories: List[int] = []
+
+class SyncPage(BaseModel):
+    # Current state of everything changed after `since`; ask again with since=seq
+    since: int
+    seq: int
+    has_more: bool
+    items: List[Item] = []
+    subcategories: List[SubCategory] = []
+    categories: List[CategoryRef] = []
+    deleted: SyncDeleted
@@ -1,8 +1,26 @@
-from PIL import Image, ImageDraw, ImageFont
+"""Icon maintenance.
+
+    python generate_icons.py [generate]   draw the built-in icons
+    python generate_icons.py optimize     re-optimize every icon, fill in missing upload variants
+    python generate_icons.py sprite       build the sprite sheet + CSS/JSON atlas for the built-in set
+    python generate_icons.py gc           delete icons nothing references (--dry-run to only list)
+    python generate_icons.py all          generate, optimize and sprite
+
+Work is spread across all cores (--jobs to override).
+"""
+from PIL import Image, ImageDraw
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
+import math
 import os
+import re
 
 ICON_DIR = "app/static/icons"
-os.makedirs(ICON_DIR, exist_ok=True)
+SPRITE_DIR = "app/static/sprite"
+SPRITE_CELL = 64
+SPRITE_COLUMNS = 5
 
 icons = {
     "can_meat.png": ("MEAT", "#8B4513"),
@@ -17,22 +35,169 @@ icons = {
     "pack_generic.png": ("ITEM", "#808080")
 }
 
+# Same naming as app/icons.py: <hash>.png plus its size/format variants
+HASHED_MAIN = re.compile(r"^([0-9a-f]{32})\.png$")
+VARIANT_SIZES = (128, 64)
+
 def generate_icon(filename, text, color):
     # Create a 64x64 transparent image
     img = Image.new('RGBA', (64, 64), (0, 0, 0, 0))
     draw = ImageDraw.Draw(img)
-    
+
     # Draw background circle/box
     draw.rectangle([4, 4, 60, 60], fill=color, outline="white", width=2)
-    
+
     # Draw Text (Simple fallback if no font)
     # Since we might not have fonts, we'll just draw a cross or simple shape for now
     # to avoid "OSError: cannot open resource"
-    
+
     # We will just save colored squares for simplicity
     img.save(os.path.join(ICON_DIR, filename))
+    return filename
+
+def _generate_one(args):
+    return generate_icon(*args)
+
+def optimize_icon(filename):
+    """Losslessly re-encode one icon; keep the result only if it is smaller.
+
+    For uploaded (hashed) icons, also recreate any missing size/WebP variant from the main file.
+    Returns the number of bytes saved.
+    """
+    path = os.path.join(ICON_DIR, filename)
+    before = os.path.getsize(path)
+    img = Image.open(path)
+    img.load()
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    img.save(tmp_path, "PNG", optimize=True)
+    saved = before - os.path.getsize(tmp_path)
+    if saved > 0:
+        os.replace(tmp_path, path)
+    else:
+        os.remove(tmp_path)
+        saved = 0
+
+    match = HASHED_MAIN.match(filename)
+    if match:
+        base = match.group(1)
+        main = img.convert("RGBA")
+        webp_path = os.path.join(ICON_DIR, f"{base}.webp")
+        if not os.path.exists(webp_path):
+            main.save(webp_path, "WEBP", quality=85, method=4)
+        variant = main
+        for size in VARIANT_SIZES:
+            variant = variant.copy()
+            variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+            variant_path = os.path.join(ICON_DIR, f"{base}_{size}.png")
+            if not os.path.exists(variant_path):
+                variant.save(variant_path, "PNG", optimize=True)
+    return saved
+
+def build_sprite(names):
+    """Pack icons into one sheet; write icons.png, icons.css and icons.json to SPRITE_DIR."""
+    os.makedirs(SPRITE_DIR, exist_ok=True)
+    names = sorted(names)
+    columns = min(SPRITE_COLUMNS, len(names))
+    rows = math.ceil(len(names) / columns)
+    sheet = Image.new("RGBA", (columns * SPRITE_CELL, rows * SPRITE_CELL), (0, 0, 0, 0))
+
+    atlas = {"image": "icons.png", "cell": SPRITE_CELL, "columns": columns, "rows": rows, "icons": {}}
+    for index, name in enumerate(names):
+        col, row = index % columns, index // columns
+        img = Image.open(os.path.join(ICON_DIR, name)).convert("RGBA")
+        img.thumbnail((SPRITE_CELL, SPRITE_CELL), Image.Resampling.LANCZOS)
+        # Center smaller icons in their cell
+        x = col * SPRITE_CELL + (SPRITE_CELL - img.width) // 2
+        y = row * SPRITE_CELL + (SPRITE_CELL - img.height) // 2
+        sheet.paste(img, (x, y), img)
+        atlas["icons"][name] = {"x": col * SPRITE_CELL, "y": row * SPRITE_CELL, "w": SPRITE_CELL, "h": SPRITE_CELL}
+
+    sheet_path = os.path.join(SPRITE_DIR, "icons.png")
+    sheet.save(sheet_path, "PNG", optimize=True)
+    with open(sheet_path, "rb") as f:
+        version = hashlib.sha256(f.read()).hexdigest()[:12]
+
+    # Percentage positions so the sprite scales to any element size
+    css = [
+        ".icon-sprite {",
+        f"  background-image: url('icons.png?v={version}');",
+        f"  background-size: {columns * 100}% {rows * 100}%;",
+        "  background-repeat: no-repeat;",
+        "}",
+    ]
+    for index, name in enumerate(names):
+        col, row = index % columns, index // columns
+        px = 0 if columns == 1 else col * 100 / (columns - 1)
+        py = 0 if rows == 1 else row * 100 / (rows - 1)
+        css.append(f".icon-{os.path.splitext(name)[0]} {{ background-position: {px:g}% {py:g}%; }}")
+    with open(os.path.join(SPRITE_DIR, "icons.css"), "w") as f:
+        f.write("\n".join(css) + "\n")
+    with open(os.path.join(SPRITE_DIR, "icons.json"), "w") as f:
+        json.dump(atlas, f, indent=2)
+    return len(names)
+
+def referenced_icons():
+    """Every icon filename that the database, the static mapping or the built-in set points at."""
+    from sqlalchemy import select
+    from app import database, models, mappings
+
+    # Items show their subcategory's icon, so subcategories reference every icon in use
+    with database.engine.connect() as conn:
+        names = {row[0] for row in conn.execute(select(models.SubCategory.icon_path)) if row[0]}
+    names.update(mappings.ICON_MAPPING.values())
+    names.update(icons)
+
+    # Keep the variants of every referenced upload
+    for name in list(names):
+        match = HASHED_MAIN.match(name)
+        if match:
+            base = match.group(1)
+            names.add(f"{base}.webp")
+            names.update(f"{base}_{size}.png" for size in VARIANT_SIZES)
+    return names
+
+def collect_garbage(dry_run=False):
+    keep = referenced_icons()
+    removed = []
+    for name in sorted(os.listdir(ICON_DIR)):
+        if not name.endswith((".png", ".webp")) or name in keep:
+            continue
+        removed.append(name)
+        if not dry_run:
+            os.remove(os.path.join(ICON_DIR, name))
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Warehouse 21 icon maintenance")
+    parser.add_argument("command", nargs="?", default="generate", choices=["generate", "optimize", "sprite", "gc", "all"])
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--dry-run", action="store_true", help="gc: only list what would be deleted")
+    args = parser.parse_args()
+
+    os.makedirs(ICON_DIR, exist_ok=True)
+
+    if args.command in ("generate", "all"):
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            done = list(pool.map(_generate_one, [(name, txt, col) for name, (txt, col) in icons.items()]))
+        print(f"Icons generated: {len(done)}")
+
+    if args.command in ("optimize", "all"):
+        names = [n for n in os.listdir(ICON_DIR) if n.endswith(".png")]
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            saved = sum(pool.map(optimize_icon, names, chunksize=8))
+        print(f"Icons optimized: {len(names)} ({saved} bytes saved)")
+
+    if args.command in ("sprite", "all"):
+        count = build_sprite(icons)
+        print(f"Sprite built: {count} icons -> {SPRITE_DIR}")
+
+    if args.command == "gc":
+        removed = collect_garbage(dry_run=args.dry_run)
+        verb = "Would remove" if args.dry_run else "Removed"
+        for name in removed:
+            print(f"  {name}")
+        print(f"{verb} {len(removed)} unreferenced icons.")
 
 if __name__ == "__main__":
-    for name, (txt, col) in icons.items():
-        generate_icon(name, txt, col)
-    print("Icons generated.")
+    main()
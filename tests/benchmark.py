@@ -0,0 +1,309 @@
+"""Load test / micro-benchmark for the warehouse app.
+
+Drives the ASGI app in-process (httpx ASGITransport) as a logged-in admin, against a
+freshly seeded synthetic database, and prints latency percentiles and throughput as JSON:
+
+    python tests/benchmark.py --items 10000 --requests 200 --concurrency 8 --output bench.json
+
+Runs are reproducible for a given --seed, so results can be compared across commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ADMIN_USERNAME = "bench"
+ADMIN_PASSWORD = "bench"
+
+SCENARIOS = [
+    "index",
+    "items_list",
+    "items_list_filtered",
+    "items_list_category",
+    "items_list_subcategory",
+    "items_revalidate",
+    "item_search",
+    "item_create",
+    "item_update",
+    "item_delete",
+    "subcategory_rename",
+    "ai_chat",
+]
+
+WORDS = [
+    "Тушёнка", "Сгущёнка", "Гречка", "Рис", "Шпроты", "Сайра", "Галеты", "Чай", "Кофе", "Сахар",
+    "Вода", "Квас", "Cola", "Tonic", "Beans", "Corn", "Peas", "Crackers", "Oats", "Pasta",
+]
+
+# Cyrillic, Latin and transliterated prefixes of WORDS
+SEARCH_QUERIES = ["tushenka", "греч", "sguschen", "cola", "Шпр", "чай 1", "oats 42", "kv"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Warehouse 21 benchmark")
+    parser.add_argument("--items", type=int, default=10000, help="synthetic items to seed (1k-500k)")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--rename-requests", type=int, default=20,
+                        help="requests for subcategory_rename (rewrites many rows each)")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset to run")
+    parser.add_argument("--ai-delay-ms", type=float, default=0, help="per-token delay of the stubbed AI")
+    parser.add_argument("--seed", type=int, default=21)
+    parser.add_argument("--db", default=None, help="database file (default: a temporary one)")
+    parser.add_argument("--output", default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def configure_environment(args):
+    """Point the app at the benchmark database and the fake AI provider; must run before importing it."""
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="warehouse-bench-"), "bench.db")
+    if os.path.exists(db_path):
+        sys.exit(f"{db_path} already exists; the benchmark needs a fresh database")
+    os.environ["WAREHOUSE_DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.pop("WAREHOUSE_ASYNC_DATABASE_URL", None)
+    os.environ["WAREHOUSE_AI_PROVIDER"] = "fake"
+    os.environ["WAREHOUSE_FAKE_AI_DELAY_MS"] = str(args.ai_delay_ms)
+    # Let every benchmark request through instead of measuring 429s
+    os.environ.setdefault("WAREHOUSE_AI_CONCURRENCY", str(args.concurrency))
+    os.environ.setdefault("WAREHOUSE_AI_QUEUE_DEPTH", str(args.concurrency * 4))
+    # The app serves app/static and app/templates relative to the working directory
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    return db_path
+
+
+def seed_database(count: int, rng: random.Random):
+    from app import crud, database, schemas, mappings, cache, migrations
+
+    # Creates the schema and the default categories
+    migrations.upgrade(database.engine)
+    db = database.SessionLocal()
+    try:
+        crud.create_user(db, schemas.UserCreate(username=ADMIN_USERNAME, password=ADMIN_PASSWORD), is_admin=True)
+        taxonomy = cache.get_taxonomy(db)
+        slots = [
+            (taxonomy.category_ids[cat_slug], sub_slug)
+            for cat_slug, data in mappings.CATEGORY_STRUCTURE.items()
+            for sub_slug in data["subs"]
+        ]
+        slot_ids = {slot: taxonomy.resolve_subcategory(slot[1], slot[0]) for slot in slots}
+        today = date.today()
+        chunk = []
+        for i in range(count):
+            category_id, sub_slug = rng.choice(slots)
+            chunk.append({
+                "name": f"{rng.choice(WORDS)} {i}",
+                "quantity": rng.randint(0, 50),
+                "target_quantity": rng.randint(0, 30),
+                "subcategory_id": slot_ids[(category_id, sub_slug)],
+                "expiry_date": today + timedelta(days=rng.randint(-30, 720)) if rng.random() < 0.8 else None,
+                "category_id": category_id,
+            })
+            if len(chunk) == 5000:
+                crud.bulk_insert_items(db, chunk)
+                chunk = []
+        crud.bulk_insert_items(db, chunk)
+        return slots, [sub["id"] for sub in taxonomy.subcategories]
+    finally:
+        db.close()
+
+
+def percentile(sorted_values, pct: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors: int, wall: float) -> dict:
+    values = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(values) / wall, 1) if wall else 0.0,
+        "latency_ms": {
+            "min": ms(values[0]) if values else 0.0,
+            "mean": ms(sum(values) / len(values)) if values else 0.0,
+            "p50": ms(percentile(values, 50)),
+            "p95": ms(percentile(values, 95)),
+            "p99": ms(percentile(values, 99)),
+            "max": ms(values[-1]) if values else 0.0,
+        },
+    }
+
+
+async def run_scenario(make_request, total: int, concurrency: int) -> dict:
+    """Issue `total` requests with at most `concurrency` in flight; make_request(i) returns a response."""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            response = await make_request(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_benchmarks(args, rng: random.Random, slots, subcategory_ids) -> dict:
+    import httpx
+    from app.main import app
+
+    await app.router.startup()
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post("/login", data={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD})
+            if "session" not in client.cookies:
+                raise RuntimeError(f"login failed: {response.status_code}")
+
+            category_ids = sorted({category_id for category_id, _ in slots})
+            created = []
+
+            # Conditional GET of an unchanged list: the 304 path (runs before any writes)
+            list_etag = (await client.get("/api/items/?limit=100")).headers["etag"]
+
+            async def items_revalidate(i):
+                return await client.get("/api/items/?limit=100", headers={"If-None-Match": list_etag})
+
+            async def item_create(i):
+                category_id, sub_slug = rng.choice(slots)
+                response = await client.post("/api/items/", json={
+                    "name": f"Bench {i}", "quantity": 5, "target_quantity": 10,
+                    "category_id": category_id, "subcategory": sub_slug,
+                })
+                if response.status_code == 200:
+                    created.append(response.json()["id"])
+                return response
+
+            async def item_update(i):
+                item_id = rng.randint(1, args.items)
+                return await client.patch(f"/api/items/{item_id}", json={"quantity": rng.randint(0, 50)})
+
+            async def item_delete(i):
+                return await client.delete(f"/api/items/{created.pop()}")
+
+            async def subcategory_rename(i):
+                sub_id = subcategory_ids[i % len(subcategory_ids)]
+                # Alternate names so every request really renames
+                return await client.put(f"/api/subcategories/{sub_id}", data={"name": f"Bench sub {sub_id} {i % 2}"})
+
+            scenarios = {
+                "index": (lambda i: client.get("/"), args.requests),
+                "items_list": (lambda i: client.get("/api/items/?limit=100"), args.requests),
+                "items_list_filtered": (
+                    lambda i: client.get("/api/items/", params={
+                        "limit": 60, "sort": "name", "category_id": category_ids[i % len(category_ids)],
+                    }),
+                    args.requests,
+                ),
+                # What the index page sends: default sort=id, filtered by tab and sub-tab
+                "items_list_category": (
+                    lambda i: client.get("/api/items/", params={
+                        "limit": 60, "category_id": category_ids[i % len(category_ids)],
+                    }),
+                    args.requests,
+                ),
+                "items_list_subcategory": (
+                    lambda i: client.get("/api/items/", params={
+                        "limit": 60, "category_id": slots[i % len(slots)][0], "subcategory": slots[i % len(slots)][1],
+                    }),
+                    args.requests,
+                ),
+                "items_revalidate": (items_revalidate, args.requests),
+                "item_search": (
+                    lambda i: client.get("/api/items/search", params={"q": SEARCH_QUERIES[i % len(SEARCH_QUERIES)]}),
+                    args.requests,
+                ),
+                "item_create": (item_create, args.requests),
+                "item_update": (item_update, args.requests),
+                # Deletes what item_create made
+                "item_delete": (item_delete, args.requests),
+                "subcategory_rename": (subcategory_rename, args.rename_requests),
+                # Unique messages, so the reply cache doesn't answer
+                "ai_chat": (lambda i: client.post("/api/ai/chat", json={"message": f"status report {i}"}), args.requests),
+            }
+            selected = args.scenarios.split(",")
+            for name in SCENARIOS:
+                if name not in selected:
+                    continue
+                make_request, total = scenarios[name]
+                if name == "item_delete":
+                    total = min(total, len(created))
+                results[name] = await run_scenario(make_request, total, args.concurrency)
+                print(f"{name:22s} p50 {results[name]['latency_ms']['p50']:9.2f} ms  "
+                      f"p99 {results[name]['latency_ms']['p99']:9.2f} ms  "
+                      f"{results[name]['throughput_rps']:8.1f} req/s  errors {results[name]['errors']}",
+                      file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    db_path = configure_environment(args)
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    slots, subcategory_ids = seed_database(args.items, rng)
+    seed_seconds = time.perf_counter() - started
+    print(f"seeded {args.items} items in {seed_seconds:.1f}s ({db_path})", file=sys.stderr)
+
+    results = asyncio.run(run_benchmarks(args, rng, slots, subcategory_ids))
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "items": args.items,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "ai_delay_ms": args.ai_delay_ms,
+            "seed": args.seed,
+            "seed_seconds": round(seed_seconds, 3),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+# Point the app at a throwaway database before it is imported
+_tmpdir = tempfile.mkdtemp()
+os.environ["WAREHOUSE_DATABASE_URL"] = f"sqlite:///{_tmpdir}/test.db"
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import deps, schemas
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    app.dependency_overrides[deps.require_admin] = lambda: schemas.User(id=1, username="admin", is_admin=True)
+    with TestClient(app) as c:
+        yield c
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def item(client):
+    response = client.post("/api/items/", json={"name": "Тушёнка", "quantity": 3, "target_quantity": 5, "category_id": 1})
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.mark.parametrize("field", ["name", "quantity", "target_quantity", "category_id"])
+def test_patch_rejects_null(client, item, field):
+    response = client.patch(f"/api/items/{item['id']}", json={field: None})
+    assert response.status_code == 422
+
+    items = client.get("/api/items/").json()["items"]
+    stored = next(i for i in items if i["id"] == item["id"])
+    assert stored[field] == item[field]
+    assert stored["version"] == item["version"]
+
+
+def test_patch_clears_expiry_date(client, item):
+    response = client.patch(f"/api/items/{item['id']}", json={"expiry_date": "2030-01-01"})
+    assert response.status_code == 200
+    response = client.patch(f"/api/items/{item['id']}", json={"expiry_date": None})
+    assert response.status_code == 200
+    assert response.json()["expiry_date"] is None